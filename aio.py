@@ -0,0 +1,77 @@
+"""
+Helpers to keep blocking bucket, database and RPC calls off the bot's event loop.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Bounded pool shared by every blocking call made from async code, created on first use
+# so IO_WORKERS can come from .env, which is loaded after this module is imported
+executor = None
+
+def getExecutor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("IO_WORKERS", 8)),
+            thread_name_prefix="io"
+        )
+    return executor
+
+async def run(func, *args, **kwargs):
+    """Run a blocking function in the I/O thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(getExecutor(), functools.partial(func, *args, **kwargs))
+
+class LoopMonitor:
+    """
+    Measures event loop lag: how late a sleep wakes up compared to when it was scheduled.
+    Anything blocking the loop shows up here directly.
+    """
+    def __init__(self, interval: float = 0.5, threshold: float = 0.1, samples: int = 600):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = deque(maxlen=samples)
+        self.max = 0
+        self.task = None
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.monitor())
+        return self.task
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def monitor(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0, time.perf_counter() - expected)
+
+            self.samples.append(lag)
+            self.max = max(self.max, lag)
+
+            if lag > self.threshold:
+                logger.warning("Event loop lagged %.0f ms", lag * 1000)
+
+    def stats(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"last": 0, "p50": 0, "p99": 0, "max": 0}
+
+        return {
+            "last": self.samples[-1],
+            "p50": samples[len(samples) // 2],
+            "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            "max": self.max,
+        }
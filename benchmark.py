@@ -0,0 +1,425 @@
+"""
+Load simulation for the match lifecycle.
+
+Drives Bot.matchmaking, startMatch, answer and timerHandler with simulated players, against
+a fake Telegram (a Bot API transport), a fake S3 client and a fake BSC JSON-RPC node, in a
+throwaway working directory. Reports matches/sec, match-start and answer latencies,
+event loop lag and memory, and saves them as JSON for regression comparison.
+
+    python benchmark.py --players 2000 --rate 200
+    python benchmark.py --players 2000 --compare benchmarks/baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import resource
+import tempfile
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def summary(values):
+    return {"count": len(values), "p50": percentile(values, 50), "p99": percentile(values, 99), "max": max(values, default=0)}
+
+class FakeBSC:
+    """JSON-RPC node on localhost answering the calls the wallet makes with canned values."""
+    RESULTS = {
+        "web3_clientVersion": "FakeBSC/1.0",
+        "net_version": "56",
+        "eth_chainId": "0x38",
+        "eth_blockNumber": "0x100",
+        "eth_gasPrice": hex(3 * 10 ** 9),
+        "eth_getBalance": "0x0",
+        "eth_getTransactionCount": "0x0",
+        "eth_getCode": "0x",
+        "eth_estimateGas": "0x5208",
+    }
+
+    def __init__(self):
+        fake = self
+        self.calls = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                body = json.dumps([fake.answer(call) for call in payload] if isinstance(payload, list) else fake.answer(payload))
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def answer(self, call):
+        self.calls += 1
+        return {"jsonrpc": "2.0", "id": call.get("id"), "result": self.RESULTS.get(call.get("method"))}
+
+class FakeS3:
+    """boto3 client stand-in: downloads write a small file after a simulated transfer time."""
+    def __init__(self, latency: float, size: int = 64 * 1024):
+        self.latency = latency
+        self.size = size
+        self.downloads = 0
+
+    def download_file(self, bucket, key, path):
+        time.sleep(self.latency)
+        with open(path, "wb") as f:
+            f.write(os.urandom(self.size))
+        self.downloads += 1
+
+    def upload_file(self, path, bucket, key):
+        time.sleep(self.latency)
+
+    def list_objects_v2(self, Bucket):
+        return {"Contents": []}
+
+def makeFakeTelegram(latency: float):
+    # Imported late, the module is only used once the environment is set up
+    from telegram.request import BaseRequest
+
+    class FakeTelegram(BaseRequest):
+        """Bot API transport answering every method locally, after a simulated round trip."""
+        def __init__(self):
+            self.latency = latency
+            self.calls = {}
+            self.messageID = 0
+            self.keyboards = {} # chat -> future resolved with the answer options
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        def waitKeyboard(self, chat):
+            self.keyboards[chat] = asyncio.get_running_loop().create_future()
+            return self.keyboards[chat]
+
+        async def do_request(self, url, method, request_data=None, **kwargs):
+            name = url.rsplit("/", 1)[-1]
+            params = request_data.parameters if request_data else {}
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+            await asyncio.sleep(self.latency)
+
+            if name == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "SongRival", "username": "SongRivalBot"}
+            elif name in ("sendMessage", "sendVoice", "editMessageText"):
+                chat = int(params.get("chat_id"))
+                self.messageID += 1
+                result = {
+                    "message_id": self.messageID,
+                    "date": int(time.time()),
+                    "chat": {"id": chat, "type": "private"},
+                }
+                if name == "sendVoice":
+                    result["voice"] = {"file_id": f"voice{self.messageID}", "file_unique_id": f"v{self.messageID}", "duration": 30}
+                else:
+                    result["text"] = params.get("text", "")
+
+                markup = params.get("reply_markup")
+                if isinstance(markup, str):
+                    markup = json.loads(markup)
+                future = self.keyboards.get(chat)
+                if markup and future and not future.done():
+                    options = [row[0]["callback_data"] for row in markup["inline_keyboard"]]
+                    if all(option.startswith("answer_") for option in options):
+                        future.set_result(options)
+            else:
+                result = True
+
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return FakeTelegram()
+
+def seedCatalog(songs: int):
+    db = sqlite3.connect("db/downloader.db")
+    db.execute("CREATE TABLE IF NOT EXISTS artists (id TEXT PRIMARY KEY, name TEXT NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS songs (id TEXT PRIMARY KEY, artist TEXT NOT NULL, title TEXT NOT NULL)")
+    db.executemany("INSERT INTO artists VALUES (?, ?)", [(f"artist{i}", f"Artist {i}") for i in range(max(1, songs // 10))])
+    db.executemany(
+        "INSERT INTO songs VALUES (?, ?, ?)",
+        [(f"song{i}", f"artist{i // 10}", f"Song {i}") for i in range(songs)]
+    )
+    db.commit()
+    db.close()
+
+class Simulation:
+    def __init__(self, args, telegram):
+        import bot
+        import game
+        from ledger import toWei
+
+        self.args = args
+        self.botModule = bot
+        self.telegram = telegram
+        self.s3 = FakeS3(args.s3_latency)
+        game.bucket.client = self.s3
+
+        self.bot = bot.Bot(request=telegram, serve=False)
+        self.application = self.bot.application
+        self.updateID = 0
+
+        self.matchStarts = {} # player -> perf_counter when startMatch was called
+        self.startLatency = []
+        self.answerLatency = []
+        self.matches = 0
+        self.timeouts = 0
+        self.failures = 0
+
+        # Time the handlers the simulation doesn't call itself
+        startMatch, removeGame = self.bot.startMatch, self.bot.removeGame
+
+        async def timedStartMatch(players, betAmount):
+            now = time.perf_counter()
+            for player in players:
+                self.matchStarts[player] = now
+            return await startMatch(players, betAmount)
+
+        async def countedRemoveGame(gameID):
+            if gameID in self.bot.gameInstances:
+                self.matches += 1
+            return await removeGame(gameID)
+
+        self.bot.startMatch = timedStartMatch
+        self.bot.removeGame = countedRemoveGame
+
+        if args.bet:
+            for player in self.players():
+                bot.wallet.ledger.creditDeposit(player, toWei(args.bet * 10), f"benchmark:{player}")
+
+        # Scale the pre-game countdown, 0 measures the bot's own overhead
+        sleep = asyncio.sleep
+        bot.sleep = lambda seconds: sleep(seconds * args.countdown_scale)
+
+    def players(self):
+        return [10_000_000 + i for i in range(self.args.players)]
+
+    def callbackUpdate(self, player, data):
+        from telegram import Update
+
+        self.updateID += 1
+        return Update.de_json({
+            "update_id": self.updateID,
+            "callback_query": {
+                "id": str(self.updateID),
+                "chat_instance": str(player),
+                "data": data,
+                "from": {"id": player, "is_bot": False, "first_name": "Player"},
+                "message": {
+                    "message_id": self.updateID,
+                    "date": int(time.time()),
+                    "chat": {"id": player, "type": "private"},
+                    "text": "",
+                },
+            },
+        }, self.application.bot)
+
+    async def player(self, player, delay):
+        await asyncio.sleep(delay)
+        keyboard = self.telegram.waitKeyboard(player)
+
+        # The second player of a pair runs the whole match start inside matchmaking
+        asyncio.create_task(self.bot.matchmaking(self.callbackUpdate(player, f"bet_{self.args.bet}"), None))
+
+        try:
+            options = await asyncio.wait_for(keyboard, self.args.match_timeout)
+        except asyncio.TimeoutError:
+            self.failures += 1
+            self.bot.clear(player)
+            return
+        self.startLatency.append(time.perf_counter() - self.matchStarts[player])
+
+        await asyncio.sleep(random.uniform(0, self.args.think))
+        gameID = self.bot.sessions.gameOf(player)
+        game = self.bot.gameInstances.get(gameID)
+        if not game:
+            return
+
+        # Time out instead of answering, as the scheduler would after 120 seconds
+        if random.random() < self.args.timeouts:
+            self.timeouts += 1
+            await self.bot.timerHandler(gameID, player)
+            return
+
+        correct = "answer_" + game.convertToSongTitle(game.correctSong)
+        choice = correct if random.random() < self.args.accuracy else random.choice(options)
+
+        started = time.perf_counter()
+        await self.bot.answer(self.callbackUpdate(player, choice), None)
+        self.answerLatency.append(time.perf_counter() - started)
+
+    async def run(self):
+        bot = self.botModule
+        await self.application.initialize()
+        bot.loopMonitor.start()
+        bot.journal.start()
+        bot.scheduler.start()
+        bot.outbox.start()
+        bot.roundPool.start()
+
+        players = self.players()
+        random.shuffle(players)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[self.player(player, i / self.args.rate) for i, player in enumerate(players)])
+        elapsed = time.perf_counter() - started
+
+        await bot.journal.close()
+        bot.scheduler.stop()
+        bot.roundPool.stop()
+        bot.loopMonitor.stop()
+        await self.application.shutdown()
+
+        return {
+            "players": len(players),
+            "elapsed": elapsed,
+            "matches": self.matches,
+            "matchesPerSecond": self.matches / elapsed,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "matchStart": summary(self.startLatency),
+            "answer": summary(self.answerLatency),
+            "loopLag": bot.loopMonitor.stats(),
+            "maxRssMB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "telegramCalls": self.telegram.calls,
+            "s3Downloads": self.s3.downloads,
+            "outbox": bot.outbox.stats(),
+            "roundPool": bot.roundPool.stats(),
+        }
+
+def chainQueries(wallet, count):
+    """Time the bulk balance and nonce reads against the fake node."""
+    uids = [20_000_000 + i for i in range(count)]
+    addresses = [wallet.getWallet(uid)["address"] for uid in uids]
+
+    timings = {}
+    for name, query in [
+        ("ledgerBalances", lambda: wallet.getBalances(uids)),
+        ("chainBalances", lambda: wallet.getChainBalances(uids)),
+        ("pendingAddresses", lambda: wallet.pendingAddresses(addresses)),
+    ]:
+        started = time.perf_counter()
+        query()
+        timings[name] = time.perf_counter() - started
+
+    return {"wallets": count, "seconds": timings}
+
+def compare(results, baseline, tolerance):
+    """Print the change of each headline metric and return the regressions."""
+    metrics = [
+        ("matchesPerSecond", lambda r: r["matchesPerSecond"], True),
+        ("matchStart.p50", lambda r: r["matchStart"]["p50"], False),
+        ("matchStart.p99", lambda r: r["matchStart"]["p99"], False),
+        ("answer.p50", lambda r: r["answer"]["p50"], False),
+        ("answer.p99", lambda r: r["answer"]["p99"], False),
+        ("loopLag.p99", lambda r: r["loopLag"]["p99"], False),
+        ("maxRssMB", lambda r: r["maxRssMB"], False),
+    ]
+
+    regressions = []
+    for name, value, higherIsBetter in metrics:
+        old, new = value(baseline), value(results)
+        change = (new - old) / old if old else 0
+        worse = -change if higherIsBetter else change
+        flag = "REGRESSION" if worse > tolerance else ""
+        print(f"{name:>18}: {old:.4f} -> {new:.4f} ({change:+.1%}) {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Match lifecycle load simulation")
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=200, help="Players joining matchmaking per second")
+    parser.add_argument("--bet", type=float, default=0, help="Bet tier, paid games go through the ledger")
+    parser.add_argument("--songs", type=int, default=500, help="Size of the fake catalog")
+    parser.add_argument("--accuracy", type=float, default=0.5, help="Chance a player picks the right song")
+    parser.add_argument("--timeouts", type=float, default=0.1, help="Chance a player lets the timer run out")
+    parser.add_argument("--think", type=float, default=2, help="Max seconds a player takes to answer")
+    parser.add_argument("--countdown-scale", type=float, default=0, help="Multiplier for the 5 second countdown")
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--s3-latency", type=float, default=0.05)
+    parser.add_argument("--real-limits", action="store_true", help="Keep Telegram's send rate limits in the outbox")
+    parser.add_argument("--match-timeout", type=float, default=60, help="Seconds a player waits for a match")
+    parser.add_argument("--wallets", type=int, default=200, help="Deposit addresses queried through the batched RPC path")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", f"{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression")
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's own prints")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    sys.path.insert(0, ROOT)
+
+    # The bot keeps its databases and song cache relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="songrival-bench-")
+    os.chdir(workdir)
+    os.makedirs("db")
+    os.makedirs("temp")
+    seedCatalog(args.songs)
+
+    bsc = FakeBSC()
+    os.environ.update({
+        "BOT_TOKEN": "1:benchmark",
+        "BSC_RPC_URL": bsc.url,
+        "DO_REGION": "fake",
+        "DO_BUCKET_NAME": "fake",
+        "DO_BUCKET_ENDPOINT": "http://127.0.0.1:9",
+        "DO_ACCESS_KEY": "fake",
+        "DO_SECRET_KEY": "fake",
+    })
+    if not args.real_limits:
+        os.environ["TELEGRAM_GLOBAL_RATE"] = os.environ["TELEGRAM_CHAT_RATE"] = "1000000"
+
+    telegram = makeFakeTelegram(args.telegram_latency)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        simulation = Simulation(args, telegram)
+        results = asyncio.run(simulation.run())
+        results["chain"] = chainQueries(simulation.botModule.wallet, args.wallets)
+
+    results["args"] = vars(args)
+    results["bscCalls"] = bsc.calls
+    bsc.server.shutdown()
+
+    print(json.dumps({key: value for key, value in results.items() if key != "args"}, indent=2))
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results saved to", output)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,24 @@
 import os
 import time
 import uuid
-import random
 import asyncio
-from game import Game
-from wallet import Wallet
+from game import Game, songsDB, journal, catalog
+from timers import Scheduler
+from outbox import Outbox, HIGH, NORMAL, LOW
+from updates import ChatUpdateProcessor, runApplication
+from shards import ShardLink
+from aio import LoopMonitor
+from deposits import DepositWatcher
+from payouts import ReceiptTracker, Sweeper
+from ledger import InsufficientFunds, toWei, fromWei
+from wallet import Wallet, AsyncWallet
+from sessions import SessionRegistry
+from voicecache import VoiceCache
+from rounds import RoundPool
 from asyncio import sleep
 from dotenv import load_dotenv
+from telegram.error import BadRequest
+from telegram.request import BaseRequest
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     filters,
@@ -22,21 +34,54 @@ load_dotenv() # Take environment variables from .env.
 
 # Instances
 wallet = Wallet()
+aioWallet = AsyncWallet(wallet)
+voiceCache = VoiceCache(songsDB)
+loopMonitor = LoopMonitor()
+scheduler = Scheduler()
+outbox = Outbox(
+    globalRate=float(os.getenv("TELEGRAM_GLOBAL_RATE", 30)) / int(os.getenv("SHARDS", 1)), # Shards split the bot's limit
+    chatRate=float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+)
+roundPool = RoundPool(
+    voiceCache,
+    size=int(os.getenv("ROUND_POOL_SIZE", 4)),
+    refillDelay=float(os.getenv("ROUND_POOL_REFILL_DELAY", 1))
+)
 
 # Constants
 FEE = 0.5 # Cut from every game
+COUNTDOWN_EDITS = os.getenv("COUNTDOWN_EDITS", "false").lower() == "true" # Edit one message instead of sending ticks
 
 class Bot():
-    def __init__(self):
+    def __init__(self, shard: ShardLink = None, request: BaseRequest = None, serve: bool = True):
         self.BOT_TOKEN = os.getenv('BOT_TOKEN')
+        self.shard = shard
+        self.started = time.time() # Games escrowed before this belong to an earlier run
 
         self.withdrawData = {}
+        self.pendingWithdrawals = {} # request id -> future answered by the first shard
         self.gameInstances = {}
         self.bets = [0, 0.01, 0.05, 0.1, 0.25, 0.5, 1] # Bet amounts are in BNB
-        self.matchmakingPool = {bet: [] for bet in self.bets}
+        self.sessions = SessionRegistry(self.bets)
 
         ## Bot commands
-        self.application = Application.builder().token(self.BOT_TOKEN).build()
+        builder = (
+            Application.builder()
+            .token(self.BOT_TOKEN)
+            .post_init(self.postInit)
+            .post_shutdown(self.postShutdown)
+            .concurrent_updates(ChatUpdateProcessor(int(os.getenv("UPDATE_CONCURRENCY", 64))))
+        )
+        if self.shard:
+            # The front process receives updates and forwards this shard's share
+            builder.updater(None)
+        if request:
+            # Bot API transport, the benchmark passes a fake Telegram
+            builder.request(request)
+        if os.getenv("TELEGRAM_BASE_URL"):
+            # Local Bot API server, or the replayer's fake
+            builder.base_url(os.getenv("TELEGRAM_BASE_URL"))
+        self.application = builder.build()
 
         # Handlers
         startHandler = CommandHandler("start", self.start)
@@ -52,6 +97,8 @@ class Bot():
                 rulesHandler,
                 depositHandler,
                 withdrawHandler,
+                # A rival's answers reach the shard owning the game, which has no state for them
+                CallbackQueryHandler(self.answer, pattern="^answer_.*$"),
             ],
             states = {
                 "start": [
@@ -89,7 +136,173 @@ class Bot():
         )
 
         self.application.add_handler(conv_handler)
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+        # Load the song catalog before serving any match
+        Game.loadCatalog()
+
+        if not serve:
+            return
+        if self.shard:
+            asyncio.run(self.serveShard())
+        else:
+            runApplication(self.application)
+
+    async def serveShard(self):
+        await self.application.initialize()
+        await self.postInit(self.application)
+        await self.application.start()
+
+        try:
+            while True:
+                message = await self.shard.receive()
+                if message[0] == "stop":
+                    break
+                await self.shardMessage(*message)
+        finally:
+            await self.application.stop()
+            await self.application.shutdown()
+            await self.postShutdown(self.application)
+
+    async def shardMessage(self, kind, *args):
+        if kind == "update":
+            await self.application.update_queue.put(Update.de_json(args[0], self.application.bot))
+        elif kind == "dequeued":
+            # Paired by the front, possibly with a player of another shard
+            self.sessions.leaveQueue(args[0])
+        elif kind == "match":
+            asyncio.create_task(self.startMatch(*args))
+        elif kind == "withdraw":
+            # Another shard's payout, signed here with the only nonce manager
+            asyncio.create_task(self.withdrawFor(*args))
+        elif kind == "withdrawn":
+            requestID, result, error = args
+            future = self.pendingWithdrawals.get(requestID)
+            if future and not future.done():
+                if error:
+                    future.set_exception(Exception(error))
+                else:
+                    future.set_result(result)
+
+    async def requestWithdraw(self, uid, address, amount):
+        # Payouts share the main wallet's nonces, so only the first shard signs them
+        if not self.shard or self.shard.index == 0:
+            return await aioWallet.withdraw(uid, address, amount)
+
+        requestID = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.pendingWithdrawals[requestID] = future
+        self.shard.send("withdraw", self.shard.index, requestID, uid, address, amount)
+        try:
+            return await future
+        finally:
+            self.pendingWithdrawals.pop(requestID, None)
+
+    async def withdrawFor(self, origin, requestID, uid, address, amount):
+        try:
+            result, error = await aioWallet.withdraw(uid, address, amount), None
+        except Exception as e:
+            result, error = None, str(e) or type(e).__name__
+        self.shard.send("withdrawn", origin, requestID, result, error)
+
+    async def postInit(self, application: Application):
+        # Watch for handlers blocking the event loop
+        loopMonitor.start()
+
+        # Flush game bookkeeping in batches
+        journal.start()
+
+        # Game deadlines
+        scheduler.start()
+
+        # Rate limited outgoing messages
+        outbox.start()
+
+        # Prepare rounds while players wait in matchmaking
+        roundPool.start()
+
+        # Pick up songs the downloader adds, off the hot path
+        catalog.start()
+
+        # Chain and wallet jobs run once, in the first shard
+        if self.shard and self.shard.index != 0:
+            return
+
+        # Bets still escrowed by games that were running when the bot stopped
+        try:
+            refunded = await aioWallet.refundAbandoned(self.started)
+            if refunded:
+                print("Refunded abandoned games:", len(refunded))
+        except Exception as e:
+            print("An error occurred while refunding abandoned games.")
+            print(e)
+
+        # Credit deposits as new blocks arrive
+        self.depositWatcher = DepositWatcher(
+            wallet,
+            confirmations=int(os.getenv("DEPOSIT_CONFIRMATIONS", 3)),
+            startBlock=int(os.getenv("DEPOSIT_START_BLOCK")) if os.getenv("DEPOSIT_START_BLOCK") else None,
+            onCredit=self.depositCredited
+        )
+        self.depositWatcher.start()
+
+        # Keep a recommended gas price ready for withdrawals
+        wallet.gas.start()
+
+        # Pre-generate wallet keys for new users
+        wallet.keys.start()
+
+        # Confirm withdrawals in the background
+        self.receiptTracker = ReceiptTracker(
+            wallet,
+            maxPendingAge=float(os.getenv("PENDING_TX_MAX_AGE", 600)),
+            onReceipt=self.withdrawalSettled
+        )
+        self.receiptTracker.start()
+
+        # Withdrawals are paid from the main wallet, refill it with the users' deposits
+        self.sweeper = Sweeper(
+            wallet,
+            interval=float(os.getenv("SWEEP_INTERVAL", 600)),
+            minBalance=toWei(os.getenv("SWEEP_MIN_BNB", "0.01"))
+        )
+        self.sweeper.start()
+
+    async def postShutdown(self, application: Application):
+        # Stop the background jobs while the loop still runs, the chain jobs only exist in the first shard
+        jobs = [loopMonitor, scheduler, outbox, roundPool, catalog] + [
+            job for job in (
+                getattr(self, "depositWatcher", None),
+                wallet.gas,
+                wallet.keys,
+                getattr(self, "receiptTracker", None),
+                getattr(self, "sweeper", None),
+            ) if job
+        ]
+        tasks = [job.task for job in jobs if job.task] + list(aioWallet.payouts.workers.values())
+
+        for job in jobs:
+            job.stop() # The round pool also releases its pinned songs
+        aioWallet.payouts.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Write game changes still in memory
+        await journal.close()
+
+    async def depositCredited(self, uid, wei, tx_hash):
+        await Helper.sendMessageToID(
+            self.application.bot,
+            uid,
+            f"Deposit received: *{fromWei(wei)}* BNB"
+        )
+
+    async def withdrawalSettled(self, uid, tx_hash, amount, confirmed):
+        await Helper.sendMessageToID(
+            self.application.bot,
+            uid,
+            f"Your withdrawal of *{amount}* BNB is confirmed."
+            if confirmed
+            else f"Your withdrawal of *{amount}* BNB failed on-chain, the amount is back in your balance."
+        )
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await Choices.start(update)
@@ -114,20 +327,11 @@ class Bot():
         return "betAmount"
 
     def clear(self, uid):
-        for i in range(len(self.matchmakingPool.keys())):
-            matchmake = self.matchmakingPool[self.bets[i]]
-            if uid in matchmake:
-                # Get game ID by user ID
-                gameID = Game.getGameIDFromPlayers(self.gameInstances.values(), uid)
-
-                # Remove user from matchmaking pool
-                self.matchmakingPool[self.bets[i]].remove(uid)
-
-                # Remove game instance
-                self.removeGame(gameID)
-
-                return True
-        return False
+        # Remove user from matchmaking pool
+        left = self.sessions.leaveQueue(uid) is not None
+        if left and self.shard:
+            self.shard.send("leave", self.shard.index, uid)
+        return left
 
     async def stop(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.callback_query is None:
@@ -159,14 +363,12 @@ class Bot():
         userID = query.message.chat_id
 
         # Check if user is already in the matchmaking pool
-        for i in range(len(self.matchmakingPool.keys())):
-            matchmake = self.matchmakingPool[self.bets[i]]
-            if userID in matchmake:
-                await Helper.sendMessage(update, "Already in the matchmaking pool.")
-                return
+        if self.sessions.queueOf(userID) is not None:
+            await Helper.sendMessage(update, "Already in the matchmaking pool.")
+            return
 
         uid = update.effective_chat.id
-        gameExists = Game.getGameIDFromPlayers(self.gameInstances.values(), uid)
+        gameExists = self.sessions.gameOf(uid)
 
         if gameExists:
             await Helper.sendMessage(update, "You are already in a game.")
@@ -174,7 +376,7 @@ class Bot():
 
         # Check balance
         if (betAmount != 0):
-            balance = wallet.getBalance(uid)
+            balance = await aioWallet.getBalance(uid)
             if balance < betAmount:
                 await Helper.sendMessage(update, "Insufficient balance.")
                 return
@@ -192,21 +394,28 @@ class Bot():
         result = None
 
         # Matchmake the user
-        if len(self.matchmakingPool[betAmount]) > 0:
+        if self.shard:
+            # The front pairs players of every shard and starts the match in one of them
+            self.sessions.joinQueue(userID, betAmount)
+            self.shard.send("join", self.shard.index, userID, betAmount)
+            return "matchmaking"
+
+        rival = self.sessions.popOpponent(betAmount)
+        if rival is not None:
             result = {
-                "u1": self.matchmakingPool[betAmount].pop(0),
+                "u1": rival,
                 "u2": uid,
                 "bet": betAmount
             }
         else:
-            self.matchmakingPool[betAmount].append(userID)
+            self.sessions.joinQueue(userID, betAmount)
 
-        print("Pool:", self.matchmakingPool)
+        print("Pool:", self.sessions)
 
         # A game has been found
         if result:
-            # Start game for both parties
-            await self.startMatch([result["u1"], result["u2"]], result["bet"])
+            # Start game for both parties, the countdown must not hold this chat's update slot
+            asyncio.create_task(self.startMatch([result["u1"], result["u2"]], result["bet"]))
 
         print("Total played games: ", len(self.gameInstances))
 
@@ -220,26 +429,27 @@ class Bot():
         self.gameInstances[gameID] = Game(gameID)
         game = self.gameInstances[gameID]
         game.createEmptyGame(players, betAmount)
+        self.sessions.addGame(gameID, players)
+
+        # Lock both bets in escrow until the game is settled
+        if betAmount != 0:
+            try:
+                await aioWallet.escrow(gameID, players, betAmount)
+            except InsufficientFunds:
+                for player in players:
+                    await Helper.sendMessageToID(
+                        self.application.bot,
+                        player,
+                        "A player no longer has enough balance, the match is cancelled.\n\nWanna play again? /start"
+                    )
+                await self.removeGame(gameID)
+                return
 
-        songForm = lambda song: song.split('/')[-1].split(".")[0]
-
-        # Load songs from the bucket
-        songs = Game.loadSongs()
-
-        # Select a random song as answer
-        correctSong = songForm(random.choice(songs))
-
-        # Create random choices
-        other_choices = random.sample([song for song in songs if song != correctSong], 4)
-        other_choices = [songForm(song) for song in other_choices]
-        songsPool = other_choices + [correctSong]
-
-        # Shuffle the choices
-        random.shuffle(songsPool)
-
-        # Download selected song temporarily
-        path = f"temp/temp_{correctSong}.mp3"
-        Game.downloadSong(correctSong, path)
+        # Take a prepared round: answer, choices and a locally cached song
+        round = await roundPool.pop()
+        correctSong, songsPool = round.correctSong, round.songsPool
+        game.useRound(round)
+        path = game.songPath
 
         tasks = [
             asyncio.create_task(startGame(gameID, players[0], correctSong, songsPool, path)),
@@ -251,28 +461,40 @@ class Bot():
         await asyncio.gather(*tasks)
 
     async def gameThread(self, gameID, player, correctSong, songsPool, path):
-        await Helper.sendMessageToID(
+        message = await Helper.sendMessageToID(
             bot=self.application.bot,
             id=player,
-            text="Match found! Starting game...\n\nStarting in *5* seconds."
+            text="Match found! Starting game...\n\nStarting in *5* seconds.",
+            priority=LOW
         )
 
         for i in range(4, 0, -1):
             await sleep(1)
-            await Helper.sendMessageToID(
-                bot=self.application.bot,
-                id=player,
-                text=f"*{i}*"
-            )
+
+            # Ticks are the first thing to give way under load
+            if COUNTDOWN_EDITS:
+                await Helper.editMessage(
+                    self.application.bot,
+                    message,
+                    f"Match found! Starting game...\n\nStarting in *{i}* seconds.",
+                    priority=LOW
+                )
+            else:
+                await Helper.sendMessageToID(
+                    bot=self.application.bot,
+                    id=player,
+                    text=f"*{i}*",
+                    priority=LOW
+                )
 
         game = self.gameInstances[gameID]
         game.start(correctSong, songsPool, path)
 
         # Send the song to the player
-        await Helper.sendVoice(
+        await Helper.sendSong(
             self.application.bot,
             player,
-            path
+            game
         )
 
         keyboard = [
@@ -291,13 +513,10 @@ class Bot():
             keyboard
         )
 
-        async def timerLifecycle():
-            response = True
-            while response:
-                await asyncio.sleep(10)
-                response = await self.timerHandler(gameID, player)
-
-        asyncio.create_task(timerLifecycle())
+        # Time warnings and the timeout, cancelled when the game is removed
+        for seconds in (60, 30, 10):
+            scheduler.schedule(120 - seconds, self.timerHandler, gameID, player, seconds, key=gameID)
+        scheduler.schedule(120, self.timerHandler, gameID, player, key=gameID)
 
     async def answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
@@ -306,8 +525,8 @@ class Bot():
         player = query.message.chat_id
         answer = query.data.split("_")[-1]
 
-        gameID = Game.getGameIDFromPlayers(self.gameInstances.values(), player)
-        game = self.gameInstances[gameID]
+        gameID = self.sessions.gameOf(player)
+        game = self.gameInstances.get(gameID)
 
         if not game:
             await Helper.sendMessage(update, "Game not found.")
@@ -333,15 +552,17 @@ class Bot():
 
         ## Check if the answer is correct
         # Correct answer
+        finished = False
         if answer == correctSong:
-            self.win(game, player)
+            await self.win(game, player)
 
             # Winner
             await Helper.sendMessage(
                 update,
                 f"Correct guess! You've won {game.betAmount} BNB\n\nWanna play again? /start"
                 if game.betAmount != 0
-                else "Correct guess! You've won.\n\nWanna play again? /start"
+                else "Correct guess! You've won.\n\nWanna play again? /start",
+                priority=HIGH
             )
             # Loser
             await Helper.sendMessageToID(
@@ -349,18 +570,26 @@ class Bot():
                 game.otherUser(player),
                 "Your rival has guessed correctly, you have lost.\n" +
                 f"Correct song was *{correctForm}*" +
-                "\n\nWanna play again? /start"
+                "\n\nWanna play again? /start",
+                priority=HIGH
             )
 
             # Remove game instance
-            self.removeGame(gameID)
+            await game.end()
+            await self.removeGame(gameID)
         # Incorrect answer
         else:
-            if len(game.answered) == 0:
+            # Recorded before the first await, so two wrong answers at once can't both be first
+            first = len(game.answered) == 0
+            game.answered.append(player)
+            finished = not first
+
+            if first:
                 # User Reply
                 await Helper.sendMessage(
                     update,
-                    "Wrong answer! Waiting for your rival's answer.\nIf they answer wrong too, it's a draw."
+                    "Wrong answer! Waiting for your rival's answer.\nIf they answer wrong too, it's a draw.",
+                    priority=HIGH
                 )
                 # Other User
                 """
@@ -376,7 +605,8 @@ class Bot():
                     update,
                     "Wrong answer!\nYour rival also guessed incorrectly. it's a draw.\n" +
                     f"Correct song was *{correctForm}*"
-                    "\n\nWanna play again? /start"
+                    "\n\nWanna play again? /start",
+                    priority=HIGH
                 )
                 # Other User
                 await Helper.sendMessageToID(
@@ -384,113 +614,109 @@ class Bot():
                     game.otherUser(player),
                     "Your rival has answered incorrectly. It's a draw.\n" +
                     f"Correct song was *{correctForm}*"
-                    "\n\nWanna play again? /start"
+                    "\n\nWanna play again? /start",
+                    priority=HIGH
                 )
-            # Update game instance
-            game.answered.append(player)
 
-        # End the game
-        if len(game.answered) == 2:
+        # End the game, once: only the handler that took the last answer gets here
+        if finished:
             await game.end()
 
             # Remove game instance
-            self.removeGame(gameID)
+            await self.removeGame(gameID)
 
         return "start"
 
-    async def timerHandler(self, gameID, player):
+    async def timerHandler(self, gameID, player, seconds=0):
         try: game = self.gameInstances[gameID]
         except: return False
 
-        ts = game.ts
-        seconds = 0
-        diff = time.time() - ts
-
         if player in game.answered or game.winner:
             return False
 
-        # Game timeout - Guarenteed lose/draw
-        if diff >= 120:
-            # Check if other user has answered correctly
-            if game.winner == game.otherUser(player):
-                self.win(game, player)
-
-                await Helper.sendMessageToID(
-                    self.application.bot,
-                    game.otherUser(player),
-                    f"Your rival has timed out. You've won {game.betAmount} BNB\n\n"+
-                    "Wanna play again? /start"
-                    if game.betAmount != 0
-                    else "Your rival has timed out. You've won.\n\n"+
-                    "Wanna play again? /start"
-                )
-
-                # Remove game instance
-                self.removeGame(gameID)
-            elif len(game.answered) == 0:
-                await Helper.sendMessageToID(
-                    self.application.bot,
-                    game.otherUser(player),
-                    "Both players have timed out. It's a draw.\n\n" +
-                    "Wanna play again? /start"
-                )
-            else:
-                await Helper.sendMessageToID(
-                    self.application.bot,
-                    game.otherUser(player),
-                    "Your rival has timed out. It's a draw.\n\n" +
-                    "Wanna play again? /start"
-                )
-
-            await game.end()
-            self.removeGame(gameID)
-
-            return False
-
         # Time notifications
-        if diff > 60 and diff < 70: seconds = 60
-        if diff > 90 and diff < 100: seconds = 30
-        if diff > 110 and diff < 120: seconds = 10
-
         if seconds:
             await Helper.sendMessageToID(
                 self.application.bot,
                 player,
                 f"You have {seconds} seconds left."
             )
+            return True
 
-        return True
+        # Game timeout - Guarenteed lose/draw
+        # Check if other user has answered correctly
+        if game.winner == game.otherUser(player):
+            await self.win(game, player)
 
-    def win(self, game, player):
+            await Helper.sendMessageToID(
+                self.application.bot,
+                game.otherUser(player),
+                f"Your rival has timed out. You've won {game.betAmount} BNB\n\n"+
+                "Wanna play again? /start"
+                if game.betAmount != 0
+                else "Your rival has timed out. You've won.\n\n"+
+                "Wanna play again? /start",
+                priority=HIGH
+            )
+
+            # Remove game instance
+            await self.removeGame(gameID)
+        elif len(game.answered) == 0:
+            await Helper.sendMessageToID(
+                self.application.bot,
+                game.otherUser(player),
+                "Both players have timed out. It's a draw.\n\n" +
+                "Wanna play again? /start",
+                priority=HIGH
+            )
+        else:
+            await Helper.sendMessageToID(
+                self.application.bot,
+                game.otherUser(player),
+                "Your rival has timed out. It's a draw.\n\n" +
+                "Wanna play again? /start",
+                priority=HIGH
+            )
+
+        await game.end()
+        await self.removeGame(gameID)
+
+        return False
+
+    async def win(self, game, player):
         # Update game instance
         game.answered.append(player)
         game.setWinner(player)
 
         ## Adjust balance
-        # Send losers bet to the winner's wallet address
+        # Pay the escrowed bets to the winner on the ledger, minus the fee
         try:
             if game.betAmount != 0:
                 cutFee = game.betAmount * FEE
-                res = wallet.withdraw(
-                    game.otherUser(player),
-                    wallet.getWallet(player)["address"],
-                    game.betAmount - cutFee
-                )
-                print(f"Transaction Hash: {res.tx_hash}")
-
-                # Send fee to the fee address
-                if res.tx_hash:
-                    wallet.withdraw(
-                        game.otherUser(player),
-                        os.getenv("FEE_ADDRESS"),
-                        cutFee
-                    )
+                await aioWallet.settle(game.id, player, cutFee)
         except Exception as e:
             print("An error occurred while adjusting balance.")
             print(e)
 
-    def removeGame(self, gameID):
-        self.gameInstances.pop(gameID, None)
+    async def removeGame(self, gameID):
+        game = self.gameInstances.pop(gameID, None)
+        players = self.sessions.removeGame(gameID)
+        scheduler.cancelKey(gameID)
+
+        # Send the players' updates back to their own shards
+        if self.shard and players:
+            self.shard.send("unroute", players)
+
+        if game:
+            game.releaseSong()
+
+            # Draws and timeouts give the bets back, no-op once settled
+            if game.betAmount != 0:
+                try:
+                    await aioWallet.refund(gameID)
+                except Exception as e:
+                    print("An error occurred while refunding bets.")
+                    print(e)
 
     async def deposit(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await Choices.deposit(update)
@@ -498,10 +724,10 @@ class Bot():
 
     async def withdraw(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Show balance
-        balance = wallet.getBalance(update.effective_chat.id)
+        balance = await aioWallet.getBalance(update.effective_chat.id)
 
         # Check if user is in a game
-        if Game.getGameIDFromPlayers(self.gameInstances.values(), update.effective_chat.id):
+        if self.sessions.gameOf(update.effective_chat.id):
             await Helper.sendMessage(update, "You cannot withdraw while in a game.")
             return "start"
 
@@ -532,7 +758,7 @@ class Bot():
 
         # Check balance
         try:
-            if wallet.getBalance(user_id) < float(withdraw_amount):
+            if await aioWallet.getBalance(user_id) < float(withdraw_amount):
                 await Helper.sendMessage(update, "Insufficient balance.")
                 return "start"
         except:
@@ -543,7 +769,7 @@ class Bot():
         await Helper.sendMessage(update, "Processing withdrawal...")
 
         try:
-            res = wallet.withdraw(
+            res = await self.requestWithdraw(
                 user_id,
                 self.withdrawData[user_id]["address"],
                 self.withdrawData[user_id]["amount"]
@@ -616,7 +842,7 @@ class Choices:
 
     @staticmethod
     async def deposit(update: Update):
-        address = wallet.getWallet(update.effective_chat.id)["address"]
+        address = (await aioWallet.getWallet(update.effective_chat.id))["address"]
 
         await Helper.sendMessage(
             update,
@@ -625,61 +851,121 @@ class Choices:
 
 class Helper:
     @staticmethod
-    async def sendMessage(update: Update, text: str):
-        await update.effective_chat.send_message(
-            text,
-            parse_mode='Markdown'
+    async def sendMessage(update: Update, text: str, priority=NORMAL):
+        return await outbox.send(
+            update.effective_chat.id,
+            lambda: update.effective_chat.send_message(
+                text,
+                parse_mode='Markdown'
+            ),
+            priority
+        )
+
+    @staticmethod
+    async def sendMessageToID(bot, id, text: str, priority=NORMAL):
+        return await outbox.send(
+            id,
+            lambda: bot.send_message(
+                chat_id=id,
+                text=text,
+                parse_mode='Markdown'
+            ),
+            priority
         )
 
     @staticmethod
-    async def sendMessageToID(bot, id, text: str):
-        await bot.send_message(
-            chat_id=id,
-            text=text,
-            parse_mode='Markdown'
+    async def editMessage(bot, message, text: str, priority=NORMAL):
+        return await outbox.send(
+            message.chat_id,
+            lambda: bot.edit_message_text(
+                chat_id=message.chat_id,
+                message_id=message.message_id,
+                text=text,
+                parse_mode='Markdown'
+            ),
+            priority
         )
 
     @staticmethod
-    async def sendMessageWithButtons(update: Update, text: str, keyboard: list):
+    async def sendMessageWithButtons(update: Update, text: str, keyboard: list, priority=NORMAL):
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.effective_chat.send_message(
-            text=text,
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+        return await outbox.send(
+            update.effective_chat.id,
+            lambda: update.effective_chat.send_message(
+                text=text,
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            ),
+            priority
         )
 
     @staticmethod
-    async def sendMessageToIDWithButtons(bot, id, text: str, keyboard: list):
+    async def sendMessageToIDWithButtons(bot, id, text: str, keyboard: list, priority=NORMAL):
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await bot.send_message(
-            chat_id=id,
-            text=text,
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+        return await outbox.send(
+            id,
+            lambda: bot.send_message(
+                chat_id=id,
+                text=text,
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            ),
+            priority
         )
 
     @staticmethod
-    async def reply(update: Update, text: str):
-        await update.message.reply_text(
-            text,
-            parse_mode='Markdown'
+    async def reply(update: Update, text: str, priority=NORMAL):
+        return await outbox.send(
+            update.effective_chat.id,
+            lambda: update.message.reply_text(
+                text,
+                parse_mode='Markdown'
+            ),
+            priority
         )
 
     @staticmethod
-    async def replyWithButtons(update: Update, text: str, keyboard: list):
+    async def replyWithButtons(update: Update, text: str, keyboard: list, priority=NORMAL):
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            text,
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+        return await outbox.send(
+            update.effective_chat.id,
+            lambda: update.message.reply_text(
+                text,
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            ),
+            priority
         )
 
     @staticmethod
-    async def sendVoice(bot: Bot, id: str, file):
-        await bot.send_voice(
-            chat_id=id,
-            voice=file
+    async def sendVoice(bot: Bot, id: str, file, priority=HIGH):
+        return await outbox.send(
+            id,
+            lambda: bot.send_voice(
+                chat_id=id,
+                voice=file
+            ),
+            priority
         )
 
+    @staticmethod
+    async def sendSong(bot: Bot, id: str, game: Game):
+        song = game.correctSong
+
+        # Upload the song once, then reuse Telegram's file_id
+        async with voiceCache.lock(song):
+            fileID = voiceCache.get(song)
+            if fileID:
+                try:
+                    return await Helper.sendVoice(bot, id, fileID)
+                except BadRequest:
+                    # Telegram no longer accepts the file_id
+                    await voiceCache.invalidate(song)
+
+            path = await game.acquireSong(song)
+            message = await Helper.sendVoice(bot, id, path)
+            await voiceCache.set(song, message.voice.file_id)
+            return message
+
 if __name__ == "__main__":
     Bot()
\ No newline at end of file
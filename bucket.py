@@ -19,7 +19,7 @@ class Bucket:
             endpoint_url=self.DO_BUCKET_ENDPOINT,
             aws_access_key_id=self.DO_ACCESS_KEY,
             aws_secret_access_key=self.DO_SECRET_KEY,
-            config=Config(s3={'addressing_style': 'virtual'})
+            config=Config(s3={'addressing_style': environ.get('DO_ADDRESSING_STYLE', 'virtual')})
         )
 
     def loadByType(self, types: list):
@@ -44,4 +44,70 @@ class Bucket:
             local_path,
             self.DO_BUCKET_NAME,
             f"songs/{file_key}"
-        )
\ No newline at end of file
+        )
+
+    def uploadStream(self, file_key, chunks, partSize: int = 8 * 1024 * 1024, contentType: str = "audio/mpeg"):
+        """
+        Upload an iterable of byte chunks to songs/{file_key} without a local file.
+        At most one part (partSize, 5 MB minimum) is buffered. Files smaller than a part
+        go up in a single request, larger ones as a multipart upload that is aborted on error.
+        :return: Number of bytes uploaded
+        """
+        key = f"songs/{file_key}"
+        partSize = max(partSize, 5 * 1024 * 1024) # S3's minimum for every part but the last
+        buffer = bytearray()
+        uploadID = None
+        parts = []
+        size = 0
+
+        try:
+            for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+
+                if len(buffer) >= partSize:
+                    if uploadID is None:
+                        uploadID = self.client.create_multipart_upload(
+                            Bucket=self.DO_BUCKET_NAME,
+                            Key=key,
+                            ContentType=contentType
+                        )["UploadId"]
+
+                    parts.append(self.uploadPart(key, uploadID, len(parts) + 1, bytes(buffer[:partSize])))
+                    del buffer[:partSize]
+
+            if uploadID is None:
+                self.client.put_object(
+                    Bucket=self.DO_BUCKET_NAME,
+                    Key=key,
+                    Body=bytes(buffer),
+                    ContentType=contentType
+                )
+                return size
+
+            if buffer:
+                parts.append(self.uploadPart(key, uploadID, len(parts) + 1, bytes(buffer)))
+
+            self.client.complete_multipart_upload(
+                Bucket=self.DO_BUCKET_NAME,
+                Key=key,
+                UploadId=uploadID,
+                MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            # Don't leave billed, invisible parts behind
+            if uploadID is not None:
+                self.client.abort_multipart_upload(Bucket=self.DO_BUCKET_NAME, Key=key, UploadId=uploadID)
+            raise
+
+        return size
+
+    def uploadPart(self, key, uploadID, number, body):
+        response = self.client.upload_part(
+            Bucket=self.DO_BUCKET_NAME,
+            Key=key,
+            UploadId=uploadID,
+            PartNumber=number,
+            Body=body
+        )
+        return {"PartNumber": number, "ETag": response["ETag"]}
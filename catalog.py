@@ -0,0 +1,129 @@
+import random
+import asyncio
+import sqlite3
+import logging
+from db import DB
+from aio import run
+
+logger = logging.getLogger(__name__)
+
+class SongCatalog:
+    def __init__(self, db: DB, refreshInterval: float = 30):
+        self.db = db
+        self.refreshInterval = refreshInterval
+
+        self.ids = [] # Array-backed for O(1) random picks
+        self.songs = {} # id -> {"title", "artist"}
+        self.byArtist = {} # artist -> [id]
+
+        self.lastRowID = 0
+        self.task = None
+
+    def load(self):
+        """Read the whole catalog, before the bot starts serving."""
+        self.ids = []
+        self.songs = {}
+        self.byArtist = {}
+        self.lastRowID = 0
+        return self.apply(self.fetch())
+
+    def fetch(self):
+        """Rows the downloader inserted since the last refresh, run in the I/O pool."""
+        try:
+            return self.db.fetch_all(
+                "SELECT rowid, id, artist, title FROM songs WHERE rowid > ? ORDER BY rowid",
+                (self.lastRowID,)
+            )
+        except sqlite3.OperationalError:
+            # Downloader hasn't created the table yet
+            return []
+
+    def apply(self, rows):
+        """
+        Add fetched rows to the in-memory snapshot, on the event loop like every read.
+        :return: Number of songs added
+        """
+        added = 0
+        for row in rows:
+            self.lastRowID = row["rowid"]
+            if row["id"] in self.songs: continue
+
+            self.songs[row["id"]] = {"title": row["title"], "artist": row["artist"]}
+            self.ids.append(row["id"])
+            self.byArtist.setdefault(row["artist"], []).append(row["id"])
+            added += 1
+
+        return added
+
+    async def refresh(self):
+        return self.apply(await run(self.fetch))
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.poll())
+        return self.task
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def poll(self):
+        # Picks and lookups only read the snapshot, the database is only queried here
+        while True:
+            await asyncio.sleep(self.refreshInterval)
+            try:
+                added = await self.refresh()
+                if added:
+                    logger.info("Song catalog grew by %d songs", added)
+            except Exception as e:
+                logger.warning("Song catalog refresh failed: %s", e)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, song):
+        return song in self.songs
+
+    def randomSong(self):
+        if not self.ids:
+            raise ValueError("Song catalog is empty.")
+        return random.choice(self.ids)
+
+    def sample(self, k, exclude=()):
+        """
+        Pick k distinct songs that are not in exclude.
+        Rejection sampling over the id array, so the cost is O(k) instead of O(catalog).
+        """
+        if type(exclude) not in (list, tuple, set):
+            exclude = [exclude]
+        exclude = set(exclude)
+
+        available = len(self.ids) - len([song for song in exclude if song in self.songs])
+        if k > available:
+            raise ValueError("Not enough songs in the catalog.")
+
+        # Small catalogs: rejection would spin, fall back to a filtered sample
+        if k * 2 > available:
+            return random.sample([song for song in self.ids if song not in exclude], k)
+
+        picked = []
+        seen = set(exclude)
+        while len(picked) < k:
+            song = self.ids[random.randrange(len(self.ids))]
+            if song in seen: continue
+            seen.add(song)
+            picked.append(song)
+        return picked
+
+    def songsOfArtist(self, artist):
+        return list(self.byArtist.get(artist, []))
+
+    def get(self, song):
+        return self.songs.get(song)
+
+    def title(self, song):
+        return self.get(song)["title"]
+
+    def artist(self, song):
+        return self.get(song)["artist"]
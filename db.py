@@ -1,19 +1,52 @@
+import os
 import sqlite3
+import threading
+from contextlib import contextmanager
+from aio import run
 from typing import Any, List, Tuple, Union
 
 class DB:
-    def __init__(self, db_path: str):
+    def __init__(
+        self,
+        db_path: str,
+        synchronous: str = None,
+        cache_kb: int = None,
+        mmap_mb: int = None,
+        busy_timeout_ms: int = 5000,
+        cached_statements: int = 256,
+    ):
         """Initialize the database connection."""
+        # Read here, not as parameter defaults: modules are imported before .env is loaded
         self.db_path = db_path
+        self.synchronous = synchronous or os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+        self.cache_kb = cache_kb or int(os.getenv("SQLITE_CACHE_KB", 16384))
+        self.mmap_mb = mmap_mb if mmap_mb is not None else int(os.getenv("SQLITE_MMAP_MB", 64))
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+
         self.connection = None
+        self.lock = threading.RLock() # The connection is shared with the I/O thread pool
+        self.depth = 0 # Open transaction() scopes, statements inside them don't commit
         self.connect()
 
     def connect(self):
         """Establish a connection to the SQLite database."""
         if not self.connection:
-            self.connection = sqlite3.connect(self.db_path)
+            self.connection = sqlite3.connect(
+                self.db_path,
+                check_same_thread=False,
+                cached_statements=self.cached_statements # Prepared statements reused per query string
+            )
             self.connection.row_factory = sqlite3.Row  # Optional: Enables dictionary-like row access
 
+            # WAL lets the bot, the downloader and the wallet read while another process writes
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+            self.connection.execute(f"PRAGMA cache_size = -{int(self.cache_kb)}")
+            self.connection.execute(f"PRAGMA mmap_size = {int(self.mmap_mb) * 1024 * 1024}")
+            self.connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            self.connection.execute("PRAGMA temp_store = MEMORY")
+
     def close(self):
         """Close the database connection."""
         if self.connection:
@@ -25,22 +58,58 @@ class DB:
         Execute a query and return the cursor.
         Useful for creating tables, inserting, updating, or deleting records.
         """
-        cursor = self.connection.cursor()
-        cursor.execute(query, params)
-        self.connection.commit()
-        return cursor
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(query, params)
+            if not self.depth:
+                self.connection.commit()
+            return cursor
+
+    def execute_many(self, query: str, seq_of_params: List[Union[Tuple, List]]) -> sqlite3.Cursor:
+        """Execute a query for every parameter set, in a single commit."""
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.executemany(query, seq_of_params)
+            if not self.depth:
+                self.connection.commit()
+            return cursor
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group several statements into a single commit.
+        Yields a cursor. execute_query, insert, update and delete calls made
+        inside the block join the transaction. Scopes can be nested, only the
+        outermost one commits, and everything is rolled back if the block raises.
+        """
+        with self.lock:
+            cursor = self.connection.cursor()
+            self.depth += 1
+            try:
+                yield cursor
+            except BaseException:
+                self.depth -= 1
+                if not self.depth:
+                    self.connection.rollback()
+                raise
+
+            self.depth -= 1
+            if not self.depth:
+                self.connection.commit()
 
     def fetch_all(self, query: str, params: Union[Tuple, List] = ()) -> List[sqlite3.Row]:
         """Fetch all rows from the result of a SELECT query."""
-        cursor = self.connection.cursor()
-        cursor.execute(query, params)
-        return cursor.fetchall()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(query, params)
+            return cursor.fetchall()
 
     def fetch_one(self, query: str, params: Union[Tuple, List] = ()) -> Union[sqlite3.Row, None]:
         """Fetch a single row from the result of a SELECT query."""
-        cursor = self.connection.cursor()
-        cursor.execute(query, params)
-        return cursor.fetchone()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(query, params)
+            return cursor.fetchone()
 
     def insert(self, table: str, data: dict) -> int:
         """
@@ -89,4 +158,27 @@ class DB:
 
     def __exit__(self, exc_type, exc_value, traceback):
         """Ensure the connection is closed when exiting a context."""
-        self.close()
\ No newline at end of file
+        self.close()
+
+class AsyncDB:
+    """Awaitable facade over DB, every call runs in the shared I/O thread pool."""
+    def __init__(self, db: DB):
+        self.db = db
+
+    async def execute_query(self, query: str, params: Union[Tuple, List] = ()) -> sqlite3.Cursor:
+        return await run(self.db.execute_query, query, params)
+
+    async def fetch_all(self, query: str, params: Union[Tuple, List] = ()) -> List[sqlite3.Row]:
+        return await run(self.db.fetch_all, query, params)
+
+    async def fetch_one(self, query: str, params: Union[Tuple, List] = ()) -> Union[sqlite3.Row, None]:
+        return await run(self.db.fetch_one, query, params)
+
+    async def insert(self, table: str, data: dict) -> int:
+        return await run(self.db.insert, table, data)
+
+    async def update(self, table: str, data: dict, where_clause: str, where_params: Tuple) -> int:
+        return await run(self.db.update, table, data, where_clause, where_params)
+
+    async def delete(self, table: str, where_clause: str, where_params: Tuple) -> int:
+        return await run(self.db.delete, table, where_clause, where_params)
\ No newline at end of file
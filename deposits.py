@@ -0,0 +1,160 @@
+"""
+Follows new BSC blocks and credits incoming transfers to users' deposit addresses.
+"""
+
+import asyncio
+import logging
+from aio import run
+from wallet import Wallet
+
+logger = logging.getLogger(__name__)
+
+class DepositWatcher:
+    def __init__(self, wallet: Wallet, pollInterval: float = 3, confirmations: int = 3, batchBlocks: int = 20, startBlock: int = None, onCredit=None):
+        self.wallet = wallet
+        self.db = wallet.db
+        self.web3 = wallet.web3
+        self.ledger = wallet.ledger
+
+        self.pollInterval = pollInterval
+        self.confirmations = confirmations
+        self.batchBlocks = batchBlocks
+        self.startBlock = startBlock
+        self.onCredit = onCredit # async callback(uid, amount in wei, tx hash)
+
+        self.addresses = {} # lowercase address -> uid
+        self.lastWalletRow = 0
+        self.caughtUp = True
+        self.task = None
+
+        self.blocks = 0
+        self.credits = 0
+
+        self.db.execute_query('''CREATE TABLE IF NOT EXISTS indexer_state (
+                            name TEXT PRIMARY KEY,
+                            block INTEGER NOT NULL)''')
+
+    def loadAddresses(self):
+        # Wallets are only ever added, so pick up the new rows
+        rows = self.db.fetch_all(
+            "SELECT rowid, uid, address FROM wallets WHERE rowid > ? ORDER BY rowid",
+            (self.lastWalletRow,)
+        )
+        for row in rows:
+            self.addresses[row["address"].lower()] = row["uid"]
+            self.lastWalletRow = row["rowid"]
+
+    def getCursor(self):
+        row = self.db.fetch_one("SELECT block FROM indexer_state WHERE name = ?", ("deposits",))
+        return row["block"] if row else None
+
+    def setCursor(self, cursor, block):
+        cursor.execute(
+            "INSERT OR REPLACE INTO indexer_state (name, block) VALUES (?, ?)",
+            ("deposits", block)
+        )
+
+    def open(self, block):
+        """
+        Credit what the existing deposit addresses already hold at the starting block, once,
+        as the blocks before it are never scanned.
+        """
+        self.loadAddresses()
+        addresses = list(self.addresses)
+        balances = self.wallet.rpc.getBalances(addresses, hex(max(block, 0))) if addresses else {}
+
+        with self.db.transaction() as dbCursor:
+            opened = [
+                address for address, wei in balances.items()
+                if wei and self.ledger.postDeposit(dbCursor, self.addresses[address], wei, f"opening:{address}")
+            ]
+            self.setCursor(dbCursor, block)
+
+        if opened:
+            logger.info("Credited opening balances of %d deposit addresses", len(opened))
+        self.credits += len(opened)
+        return opened
+
+    def scan(self):
+        """
+        Scan the next batch of confirmed blocks.
+        :return: List of (uid, wei, tx hash) credited
+        """
+        head = self.web3.eth.block_number - self.confirmations
+        cursor = self.getCursor()
+
+        # First run: start at the given block or the current head, never rescan history
+        if cursor is None:
+            cursor = (self.startBlock - 1) if self.startBlock is not None else head
+            self.open(cursor)
+
+        if cursor >= head:
+            self.caughtUp = True
+            return []
+
+        self.loadAddresses()
+
+        last = min(head, cursor + self.batchBlocks)
+        self.caughtUp = last == head
+        credits = []
+        for number in range(cursor + 1, last + 1):
+            block = self.web3.eth.get_block(number, full_transactions=True)
+            for tx in block["transactions"]:
+                if not tx["to"] or not tx["value"]: continue
+
+                uid = self.addresses.get(tx["to"].lower())
+                if uid is not None:
+                    credits.append((uid, tx["value"], tx["hash"].hex()))
+
+        # Credits and the cursor move together, a restart resumes after the last committed block
+        with self.db.transaction() as dbCursor:
+            credited = [
+                credit for credit in credits
+                if self.ledger.postDeposit(dbCursor, *credit)
+            ]
+            self.setCursor(dbCursor, last)
+
+        self.blocks += last - cursor
+        self.credits += len(credited)
+
+        # Cached on-chain balances are stale after new blocks
+        self.wallet.balances.invalidate()
+
+        return credited
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.watch())
+        return self.task
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def watch(self):
+        while True:
+            try:
+                credited = await run(self.scan)
+            except Exception as e:
+                logger.warning("Deposit scan failed: %s", e)
+                await asyncio.sleep(self.pollInterval)
+                continue
+
+            if credited:
+                logger.info("Credited %d deposits", len(credited))
+                if self.onCredit:
+                    for credit in credited:
+                        try:
+                            await self.onCredit(*credit)
+                        except Exception as e:
+                            logger.warning("Deposit notification failed: %s", e)
+
+            # Still catching up, scan the next batch right away
+            if not self.caughtUp:
+                continue
+
+            await asyncio.sleep(self.pollInterval)
+
+    def stats(self):
+        return {"cursor": self.getCursor(), "blocks": self.blocks, "credits": self.credits, "addresses": len(self.addresses)}
@@ -3,13 +3,20 @@ This scripts works at background to download songs using a Spotify downloader AP
 and store them in the DigitalOcean bucket.
 """
 
+import time
+import json
+import random
 import asyncio
 import requests
+import threading
 from db import DB
+from aio import run
 from bucket import Bucket
 from data.artists import artists
-from os import getenv, path, remove
+from os import getenv
 from fake_useragent import UserAgent
+from collections import deque
+from pipeline import Pipeline, Stage, RateLimiter
 
 ua = UserAgent()
 bucket = Bucket()
@@ -27,52 +34,362 @@ async def main():
                         id TEXT PRIMARY KEY,
                         name TEXT NOT NULL)''')
 
+    db.execute_query("CREATE INDEX IF NOT EXISTS artists_name ON artists (name)")
+
     db.execute_query('''CREATE TABLE IF NOT EXISTS songs (
                         id TEXT PRIMARY KEY,
                         artist TEXT NOT NULL,
                         title TEXT NOT NULL)''')
 
-    for artist in artists:
-        # Check if artist ID is in DB
-        artistID = db.fetch_one("SELECT * FROM artists WHERE name = ?", (artist,))
+    queue = WorkQueue(db, maxAttempts=int(getenv("DOWNLOADER_MAX_ATTEMPTS", 5)))
+    ingestion = Ingestion(api, queue)
+    stats = await ingestion.run(artists)
+
+    # Tracks that failed for now are retried when they're due, across restarts too
+    while (due := await run(queue.nextRetry)) is not None:
+        await asyncio.sleep(max(0, due - time.time()))
+        stats = await ingestion.run([])
+
+    print("Song downloader finished:")
+    for stage, stageStats in stats.items():
+        print(f"  {stage}: {stageStats}")
+    print(f"  api: {api.limiter.stats()}")
+    print(f"  links: {api.poller.stats()}")
+    print(f"  cache: {api.cache.stats()}")
+    print(f"  queue: {queue.stats()}")
+
+class WorkQueue:
+    """
+    Per-track download state, so a restart resumes where the last run stopped:
+    pending -> link-ready -> uploaded, or failed once the attempts run out.
+    Failed steps are retried with exponential backoff.
+    """
+    PENDING = "pending"
+    LINK_READY = "link-ready"
+    UPLOADED = "uploaded"
+    FAILED = "failed"
+
+    def __init__(self, db: DB, maxAttempts: int = 5, retryDelay: float = 60, maxRetryDelay: float = 3600):
+        self.db = db
+        self.maxAttempts = maxAttempts
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+
+        self.db.execute_query('''CREATE TABLE IF NOT EXISTS tracks (
+                            id TEXT PRIMARY KEY,
+                            artist TEXT NOT NULL,
+                            state TEXT NOT NULL DEFAULT 'pending',
+                            title TEXT,
+                            link TEXT,
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            next_retry REAL NOT NULL DEFAULT 0,
+                            error TEXT,
+                            updated REAL)''')
+
+        self.db.execute_query("CREATE INDEX IF NOT EXISTS tracks_state ON tracks (state, next_retry)")
+
+    def enqueue(self, artist: str, artistID: str, tracks: list):
+        """Queue an artist's new tracks and mark the artist as looked up, in one commit."""
+        with self.db.transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO tracks (id, artist, updated) "
+                "SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM songs WHERE id = ?)",
+                [(track, artist, time.time(), track) for track in tracks]
+            )
+            cursor.execute("INSERT OR IGNORE INTO artists (id, name) VALUES (?, ?)", (artistID, artist))
+
+        return self.due(artist=artist)
+
+    def due(self, artist: str = None):
+        """Pending and link-ready tracks whose retry time has come."""
+        query = "SELECT * FROM tracks WHERE state IN (?, ?) AND next_retry <= ?"
+        params = [self.PENDING, self.LINK_READY, time.time()]
+        if artist is not None:
+            query += " AND artist = ?"
+            params.append(artist)
+        return [dict(row) for row in self.db.fetch_all(query + " ORDER BY next_retry", params)]
+
+    def nextRetry(self):
+        row = self.db.fetch_one(
+            "SELECT MIN(next_retry) AS due FROM tracks WHERE state IN (?, ?)",
+            (self.PENDING, self.LINK_READY)
+        )
+        return row["due"]
+
+    def linkReady(self, track: dict, title: str, link: str):
+        self.db.update("tracks", {
+            "state": self.LINK_READY,
+            "title": title,
+            "link": link,
+            "updated": time.time(),
+        }, "id = ?", (track["id"],))
+
+    def uploaded(self, track: dict):
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                "UPDATE tracks SET state = ?, link = NULL, error = NULL, updated = ? WHERE id = ?",
+                (self.UPLOADED, time.time(), track["id"])
+            )
+            cursor.execute(
+                "INSERT OR IGNORE INTO songs (id, artist, title) VALUES (?, ?, ?)",
+                (track["id"], track["artist"], track["title"])
+            )
 
+    def retry(self, track: dict, error: str):
+        """Count a failed attempt. The link is dropped, download links expire."""
+        attempts = track["attempts"] + 1
+        state = self.FAILED if attempts >= self.maxAttempts else self.PENDING
+        delay = min(self.retryDelay * 2 ** (attempts - 1), self.maxRetryDelay)
+
+        self.db.update("tracks", {
+            "state": state,
+            "link": None,
+            "attempts": attempts,
+            "next_retry": time.time() + delay,
+            "error": error,
+            "updated": time.time(),
+        }, "id = ?", (track["id"],))
+        return state
+
+    def stats(self):
+        rows = self.db.fetch_all("SELECT state, COUNT(*) AS tracks FROM tracks GROUP BY state")
+        return {row["state"]: row["tracks"] for row in rows}
+
+class Ingestion:
+    """
+    artist name -> artist ID -> top tracks -> download link -> bucket
+    Each step is a pipeline stage with its own workers. API calls share one rate limiter.
+    Tracks are checkpointed in the work queue, unfinished ones re-enter at the step they reached.
+    """
+    def __init__(self, api: "API", queue: WorkQueue):
+        self.api = api
+        self.queue = queue
+        self.pipeline = Pipeline([
+            Stage("resolve", self.resolve, workers=2),
+            Stage("tracks", self.tracks, workers=2),
+            Stage("link", self.link, workers=int(getenv("DOWNLOADER_LINK_WORKERS", 32))), # Mostly waiting for links
+            Stage("transfer", self.transfer, workers=int(getenv("DOWNLOADER_TRANSFER_WORKERS", 4))),
+        ])
+
+    async def run(self, names):
+        # Resume tracks left unfinished by earlier runs
+        due = await run(self.queue.due)
+        return await self.pipeline.run(names, {
+            "link": [track for track in due if track["state"] == WorkQueue.PENDING],
+            "transfer": [track for track in due if track["state"] == WorkQueue.LINK_READY],
+        })
+
+    async def resolve(self, name):
         # Skip if artist ID is already in DB
-        if artistID: continue
-    
-        # Get artist ID from the API
-        artistID = api.getArtistByName(artist)
-        if not artistID: continue
+        if await run(db.fetch_one, "SELECT * FROM artists WHERE name = ?", (name,)):
+            return []
 
-        # Get top songs from artist
-        topTracks = api.getTopTracks(artistID)
-        if not topTracks: continue
+        artistID = await self.api.getArtistByName(name)
+        return [(name, artistID)] if artistID else []
 
-        for track in topTracks:
-            # Check if song is already in DB
-            song = db.fetch_one("SELECT * FROM songs WHERE id = ?", (track,))
-            if song: continue
+    async def tracks(self, artist):
+        name, artistID = artist
 
-            # Download the song
-            songTitle = await api.downloadSong(track)
-            if not songTitle: continue
+        # Get top songs from artist
+        topTracks = await self.api.getTopTracks(artistID)
+        if not topTracks:
+            return []
+
+        return await run(self.queue.enqueue, name, artistID, topTracks)
+
+    async def link(self, track: dict):
+        try:
+            data = await self.api.getDownloadLink(track["id"])
+        except Exception as e:
+            # Scheduled like any other miss, so main waits for the retry time instead of rerunning it at once
+            await run(self.queue.retry, track, str(e))
+            print(f"Failed to get a download link for {track['id']}: {e}")
+            return []
+
+        if not data:
+            await run(self.queue.retry, track, "no download link")
+            return []
+
+        await run(self.queue.linkReady, track, data["title"], data["downloadLink"])
+        return [{**track, "state": WorkQueue.LINK_READY, "title": data["title"], "link": data["downloadLink"]}]
+
+    async def transfer(self, track: dict):
+        try:
+            # Stream the song into the bucket
+            size = await run(self.api.transferSong, track["link"], track["id"])
+        except Exception as e:
+            size = None
+            print(f"Failed to transfer {track['id']}: {e}")
+
+        if not size:
+            await run(self.queue.retry, track, "transfer failed")
+            return []
+
+        # Store song in DB
+        await run(self.queue.uploaded, track)
+        print(f"Downloaded: {track['id']}")
+        return []
+
+class LinkPoller:
+    """
+    Download link polling schedule: the first request goes out right away, the next one
+    after the typical readiness latency seen so far, then exponential backoff with jitter
+    until the deadline.
+    """
+    def __init__(self, initialDelay: float = 5, maxDelay: float = 60, deadline: float = 300, history: int = 100):
+        self.initialDelay = initialDelay
+        self.maxDelay = maxDelay
+        self.deadline = deadline
+        self.latencies = deque(maxlen=history)
+
+        self.polls = 0
+        self.ready = 0
+        self.expired = 0
+
+    def typical(self):
+        if not self.latencies:
+            return self.initialDelay
+        return sorted(self.latencies)[len(self.latencies) // 2]
+
+    def record(self, lastMiss: float, found: float):
+        # The link got ready somewhere between the last miss and the hit
+        self.ready += 1
+        self.latencies.append((lastMiss + found) / 2)
+
+    def delays(self):
+        delay = max(self.typical(), 0.5)
+        while True:
+            yield random.uniform(delay / 2, delay)
+            delay = min(delay * 2, self.maxDelay)
+
+    def stats(self):
+        return {"polls": self.polls, "ready": self.ready, "expired": self.expired, "typical": round(self.typical(), 1)}
+
+class ResponseCache:
+    """
+    API metadata kept in downloader.db, keyed by endpoint and params.
+    Misses (an artist without an ID, no top tracks) are cached too, for a shorter time.
+    """
+    def __init__(self, db: DB):
+        self.db = db
+        self.hits = 0
+        self.misses = 0
+
+        self.db.execute_query('''CREATE TABLE IF NOT EXISTS api_cache (
+                            key TEXT PRIMARY KEY,
+                            value TEXT,
+                            expires REAL NOT NULL)''')
+
+        self.db.execute_query("DELETE FROM api_cache WHERE expires <= ?", (time.time(),))
+
+    def key(self, endpoint: str, params: dict):
+        return endpoint + "?" + json.dumps(params, sort_keys=True)
+
+    def get(self, key: str):
+        """Return (True, value) for a fresh entry, (False, None) otherwise."""
+        row = self.db.fetch_one("SELECT value FROM api_cache WHERE key = ? AND expires > ?", (key, time.time()))
+        if not row:
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        return True, json.loads(row["value"])
+
+    def set(self, key: str, value, ttl: float):
+        self.db.execute_query(
+            "INSERT OR REPLACE INTO api_cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl)
+        )
 
-            # Store song in DB
-            db.insert("songs", {"id": track, "artist": artist, "title": songTitle})
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
 
-        # Store artist ID in DB
-        db.insert("artists", {"name": artist, "id": artistID})
+class API:
+    # Cache lifetimes in seconds
+    ARTIST_TTL = 30 * 86400 # Artist IDs don't change
+    TOP_TRACKS_TTL = 86400
+    NEGATIVE_TTL = 3600 # Misses, the API may know the artist soon
 
-        await asyncio.sleep(5)
+    # Metadata requests answered with an error or 429 before the artist is given up until the next run
+    ATTEMPTS = 5
 
-class API:
-    def __init__(self):
-        self.baseURL = "https://spotify-downloader9.p.rapidapi.com"
+    def __init__(self, baseURL: str = None, limiter: RateLimiter = None, cache: ResponseCache = None):
+        self.baseURL = baseURL or getenv("RAPIDAPI_URL", "https://spotify-downloader9.p.rapidapi.com")
         self.headers =  {
             'x-rapidapi-key': getenv("RAPIDAPI_KEY"),
             'x-rapidapi-host': self.baseURL.split('//')[1]
         }
 
-    def getArtistByName(self, name: str):
+        # Every endpoint counts against the same RapidAPI quota
+        self.limiter = limiter or RateLimiter(
+            float(getenv("RAPIDAPI_RATE", 1)),
+            float(getenv("RAPIDAPI_BURST", 5))
+        )
+        self.poller = LinkPoller(
+            maxDelay=float(getenv("LINK_POLL_MAX_DELAY", 60)),
+            deadline=float(getenv("LINK_POLL_DEADLINE", 300))
+        )
+        self.cache = cache or ResponseCache(db)
+        self.local = threading.local()
+
+    def session(self):
+        # requests.Session is not thread safe, keep one per worker for keep-alive
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    async def request(self, endpoint: str, params: dict):
+        await self.limiter.acquire()
+
+        # The session is picked in the worker thread, each thread keeps its own
+        def get():
+            return self.session().get(f"{self.baseURL}/{endpoint}", headers=self.headers, params=params, timeout=30)
+
+        response = await run(get)
+
+        if response.status_code == 429:
+            retryAfter = response.headers.get("Retry-After", "")
+            self.limiter.block(float(retryAfter) if retryAfter.isdigit() else 60)
+
+        # Errors are not answers, callers must not cache them
+        if response.status_code != 200:
+            return None
+
+        try: return response.json()
+        except: return None
+
+    async def cached(self, endpoint: str, params: dict, extract, ttl: float):
+        """
+        Metadata request through the response cache.
+        :param extract: Turns the response into the value, None when the API has no answer
+        """
+        key = self.cache.key(endpoint, params)
+        found, value = await run(self.cache.get, key)
+        if found:
+            return value
+
+        obj = None
+        for attempt in range(self.ATTEMPTS):
+            if attempt:
+                # After a 429 the limiter also holds the retry back until the window passes
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+            try:
+                obj = await self.request(endpoint, params)
+            except requests.RequestException as e:
+                print(f"Request to {endpoint} failed: {e}")
+
+            if obj is not None:
+                break
+
+        if obj is None:
+            return None
+
+        value = extract(obj)
+        await run(self.cache.set, key, value, ttl if value else self.NEGATIVE_TTL)
+        return value
+
+    async def getArtistByName(self, name: str):
         queryString = {
             "q": name,
             "type": "artists",
@@ -80,99 +397,89 @@ class API:
             "offset":"0",
         }
 
-        response = requests.get(
-            f"{self.baseURL}/search",
-            headers=self.headers,
-            params=queryString
-        )
+        def extract(obj):
+            try: id = obj["data"]["artists"]["items"][0]["id"]
+            except: return None
 
-        try: obj = response.json()
-        except: return None
+            if not id:
+                return None
+            return id
 
-        id = obj["data"]["artists"]["items"][0]["id"]
+        return await self.cached("search", queryString, extract, self.ARTIST_TTL)
 
-        if not id:
-            return None
-        return id
-
-    def getTopTracks(self, artistID: str):
+    async def getTopTracks(self, artistID: str):
         queryString = {
             "id": artistID,
             "country": "US",
         }
 
-        response = requests.get(
-            f"{self.baseURL}/artistTopTracks",
-            headers=self.headers,
-            params=queryString
-        )
+        def extract(obj):
+            try: return [track["id"] for track in obj["data"]["tracks"]]
+            except: return None
 
-        try: obj = response.json()
-        except: return None
-        return map(lambda track: track["id"], obj["data"]["tracks"])
+        return await self.cached("artistTopTracks", queryString, extract, self.TOP_TRACKS_TTL)
 
-    async def downloadSong(self, trackID: str):
-        obj = {"success": False}
-        retries = 1
+    async def getDownloadLink(self, trackID: str):
+        """Poll until the API has a download link for the track. Returns {downloadLink, title} or None."""
+        queryString = {
+            "songId": f"https://open.spotify.com/track/{trackID}",
+        }
 
-        while not obj["success"] and retries < 4: # Max 12 retries
-            await asyncio.sleep(40) # Wait for download link
-            print("Retry: ", retries)
+        started = time.monotonic()
+        lastMiss = 0
+        delays = self.poller.delays()
 
-            queryString = {
-                "songId": f"https://open.spotify.com/track/{trackID}",
-            }
+        while True:
+            self.poller.polls += 1
+            obj = await self.request("downloadSong", queryString)
+            elapsed = time.monotonic() - started
 
-            response = requests.get(
-                f"{self.baseURL}/downloadSong",
-                headers=self.headers,
-                params=queryString
-            )
+            if obj and obj.get("success"):
+                self.poller.record(lastMiss, elapsed)
+                return obj["data"]
 
-            try: obj = response.json()
-            except: break
+            lastMiss = elapsed
+            remaining = self.poller.deadline - elapsed
+            if remaining <= 0:
+                break
 
-            print(obj)
-            retries += 1
+            # Wait for download link
+            await asyncio.sleep(min(next(delays), remaining))
 
-        if not obj["success"]:
-            print(f"Failed to download, cannot get download link: {trackID}")
-            return False
+        self.poller.expired += 1
+        print(f"Failed to download, cannot get download link: {trackID}")
+        return None
 
-        link = obj["data"]["downloadLink"]
-        
+    def transferSong(self, link: str, trackID: str):
+        """Stream the MP3 from the download link into the bucket. Returns the bytes uploaded, or None."""
         headers = {
             "Accept": "*/*",
             "Connection": "keep-alive",
             "User-Agent": ua.chrome
         }
-        downloadResponse = requests.get(
-            link,
-            stream=True,
-            headers=headers
-        )
 
-        output_directory = "temp"
-        output_filename = f"{trackID}.mp3"
-        output_path = path.join(output_directory, output_filename)
+        with self.session().get(link, stream=True, headers=headers, timeout=60) as downloadResponse:
+            if downloadResponse.status_code != 200:
+                print(f"Failed to download: {trackID}")
+                return None
 
-        if downloadResponse.status_code != 200:
-            print(f"Failed to download: {trackID}")
-            return
-
-        # Save the file
-        with open(output_path, "wb") as file:
-            for chunk in downloadResponse.iter_content(chunk_size=8192):
-                file.write(chunk)
+            return bucket.uploadStream(
+                f"{trackID}.mp3",
+                downloadResponse.iter_content(chunk_size=64 * 1024),
+                partSize=int(getenv("S3_PART_MB", 8)) * 1024 * 1024
+            )
 
-        # Upload file to bucket
-        bucket.uploadFile(output_filename, output_path)
+    async def downloadSong(self, trackID: str):
+        """Link and transfer a single track outside the pipeline. Returns its title."""
+        data = await self.getDownloadLink(trackID)
+        if not data:
+            return False
 
-        # Remove file from temp folder
-        remove(output_path)
+        if not await run(self.transferSong, data["downloadLink"], trackID):
+            return None
 
         print(f"Downloaded: {trackID}")
-        return obj["data"]["title"]
+        return data["title"]
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
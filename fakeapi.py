@@ -0,0 +1,120 @@
+"""
+Local stand-in for the Spotify downloader API, to run the downloader without spending quota.
+
+    python fakeapi.py --port 8089
+    RAPIDAPI_URL=http://127.0.0.1:8089 python downloader.py
+"""
+
+import time
+import json
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeSpotifyAPI:
+    """
+    Every artist has `tracks` top tracks. A track's download link becomes ready
+    `ready` seconds after it was first requested, like the real API preparing it.
+    Requests above `rate` per second get a 429.
+    """
+    def __init__(self, port: int = 0, tracks: int = 10, ready: float = 2, rate: float = 0, songBytes: int = 256 * 1024):
+        self.tracks = tracks
+        self.ready = ready
+        self.rate = rate
+        self.songBytes = songBytes
+
+        self.lock = threading.Lock()
+        self.requested = {} # track -> first link request time
+        self.window = [] # Request times in the last second
+        self.calls = {}
+        self.limited = 0
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                status, body, contentType = api.handle(url.path, {key: values[0] for key, values in parse_qs(url.query).items()})
+
+                self.send_response(status)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def limit(self):
+        if not self.rate:
+            return False
+
+        with self.lock:
+            now = time.monotonic()
+            self.window = [ts for ts in self.window if now - ts < 1]
+            if len(self.window) >= self.rate:
+                self.limited += 1
+                return True
+            self.window.append(now)
+            return False
+
+    def handle(self, route: str, params: dict):
+        endpoint = route.strip("/").split("/")[0]
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+        # Song files are served like the CDN behind the download links, without quota
+        if endpoint == "files":
+            return 200, b"\0" * self.songBytes, "audio/mpeg"
+
+        if self.limit():
+            return 429, json.dumps({"message": "Too many requests"}).encode(), "application/json"
+
+        if endpoint == "search":
+            name = params.get("q", "")
+            items = [{"id": "artist-" + name.lower().replace(" ", "-"), "name": name}] if name else []
+            data = {"artists": {"items": items}}
+        elif endpoint == "artistTopTracks":
+            artist = params.get("id", "")
+            data = {"tracks": [{"id": f"{artist}-track{i}"} for i in range(self.tracks)]}
+        elif endpoint == "downloadSong":
+            track = params.get("songId", "").rsplit("/", 1)[-1]
+            with self.lock:
+                first = self.requested.setdefault(track, time.monotonic())
+
+            if time.monotonic() - first < self.ready:
+                return 200, json.dumps({"success": False, "message": "Link is being prepared"}).encode(), "application/json"
+
+            data = {"title": f"Song {track}", "downloadLink": f"{self.url}/files/{track}.mp3"}
+        else:
+            return 404, json.dumps({"message": "Not found"}).encode(), "application/json"
+
+        return 200, json.dumps({"success": True, "data": data}).encode(), "application/json"
+
+    def stats(self):
+        return {"calls": dict(self.calls), "limited": self.limited}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Spotify downloader API")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--tracks", type=int, default=10, help="Top tracks per artist")
+    parser.add_argument("--ready", type=float, default=2, help="Seconds until a download link is ready")
+    parser.add_argument("--rate", type=float, default=0, help="Requests per second before answering 429, 0 for no limit")
+    args = parser.parse_args()
+
+    api = FakeSpotifyAPI(args.port, args.tracks, args.ready, args.rate)
+    print("Fake Spotify downloader API on", api.url)
+    api.server.serve_forever()
@@ -0,0 +1,181 @@
+"""
+In-memory, S3-compatible stand-in for the bucket, to check uploads without DigitalOcean.
+Understands path-style object PUT/GET/HEAD, multipart uploads and ListObjectsV2.
+
+    python fakes3.py --port 9000
+    DO_BUCKET_ENDPOINT=http://127.0.0.1:9000 DO_ADDRESSING_STYLE=path python downloader.py
+"""
+
+import uuid
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs, unquote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeS3:
+    def __init__(self, port: int = 0):
+        self.lock = threading.Lock()
+        self.objects = {} # (bucket, key) -> bytes
+        self.uploads = {} # uploadID -> {partNumber: bytes}
+
+        self.puts = 0
+        self.parts = 0
+        self.aborted = 0
+        self.largestBody = 0 # Largest single request body, bounds the client's buffering
+
+        s3 = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Needed for boto3's Expect: 100-continue
+
+            def do_PUT(self): s3.handle(self)
+            def do_POST(self): s3.handle(self)
+            def do_GET(self): s3.handle(self)
+            def do_HEAD(self): s3.handle(self)
+            def do_DELETE(self): s3.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def reply(self, request, status, body: bytes = b"", headers: dict = None):
+        request.send_response(status)
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        if request.command != "HEAD":
+            request.wfile.write(body)
+
+    def xml(self, request, root: str, fields: dict):
+        body = "".join(f"<{name}>{escape(str(value))}</{name}>" for name, value in fields.items())
+        self.reply(request, 200, f'<?xml version="1.0" encoding="UTF-8"?><{root}>{body}</{root}>'.encode(), {"Content-Type": "application/xml"})
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        query = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+
+        body = request.rfile.read(int(request.headers.get("Content-Length") or 0))
+        with self.lock:
+            self.largestBody = max(self.largestBody, len(body))
+
+        method = request.command
+        if method == "GET" and not key:
+            return self.list(request, bucket, query.get("prefix", ""))
+
+        if method == "POST" and "uploads" in query:
+            uploadID = uuid.uuid4().hex
+            with self.lock:
+                self.uploads[uploadID] = {}
+            return self.xml(request, "InitiateMultipartUploadResult", {"Bucket": bucket, "Key": key, "UploadId": uploadID})
+
+        if method == "PUT" and "uploadId" in query:
+            with self.lock:
+                if query["uploadId"] not in self.uploads:
+                    return self.reply(request, 404)
+                self.uploads[query["uploadId"]][int(query["partNumber"])] = body
+                self.parts += 1
+            return self.reply(request, 200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+        if method == "POST" and "uploadId" in query:
+            numbers = [int(part.text) for part in ElementTree.fromstring(body).iter() if part.tag.endswith("PartNumber")]
+            with self.lock:
+                parts = self.uploads.pop(query["uploadId"], None)
+                if parts is None:
+                    return self.reply(request, 404)
+                data = b"".join(parts[number] for number in numbers)
+                self.objects[(bucket, key)] = data
+            return self.xml(request, "CompleteMultipartUploadResult", {
+                "Location": f"{self.url}/{bucket}/{key}",
+                "Bucket": bucket,
+                "Key": key,
+                "ETag": f'"{hashlib.md5(data).hexdigest()}-{len(numbers)}"',
+            })
+
+        if method == "DELETE" and "uploadId" in query:
+            with self.lock:
+                self.uploads.pop(query["uploadId"], None)
+                self.aborted += 1
+            return self.reply(request, 204)
+
+        if method == "PUT":
+            with self.lock:
+                self.objects[(bucket, key)] = body
+                self.puts += 1
+            return self.reply(request, 200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+        if method in ("GET", "HEAD"):
+            data = self.objects.get((bucket, key))
+            if data is None:
+                return self.reply(request, 404)
+
+            # boto3 downloads large objects as parallel ranged GETs
+            ranged = request.headers.get("Range", "")
+            if ranged.startswith("bytes="):
+                start, _, end = ranged[6:].partition("-")
+                start, end = int(start), min(int(end or len(data) - 1), len(data) - 1)
+                return self.reply(request, 206, data[start:end + 1], {
+                    "Content-Type": "application/octet-stream",
+                    "Content-Range": f"bytes {start}-{end}/{len(data)}",
+                    "ETag": f'"{hashlib.md5(data).hexdigest()}"',
+                })
+
+            return self.reply(request, 200, data, {
+                "Content-Type": "application/octet-stream",
+                "ETag": f'"{hashlib.md5(data).hexdigest()}"',
+                "Last-Modified": "Thu, 01 Jan 2026 00:00:00 GMT",
+            })
+
+        if method == "DELETE":
+            with self.lock:
+                self.objects.pop((bucket, key), None)
+            return self.reply(request, 204)
+
+        self.reply(request, 400)
+
+    def list(self, request, bucket, prefix):
+        with self.lock:
+            keys = sorted(key for name, key in self.objects if name == bucket and key.startswith(prefix))
+            contents = "".join(
+                f"<Contents><Key>{escape(key)}</Key><Size>{len(self.objects[(bucket, key)])}</Size></Contents>"
+                for key in keys
+            )
+
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?><ListBucketResult>'
+            f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(keys)}</KeyCount>"
+            f"<IsTruncated>false</IsTruncated>{contents}</ListBucketResult>"
+        )
+        self.reply(request, 200, body.encode(), {"Content-Type": "application/xml"})
+
+    def stats(self):
+        return {
+            "objects": len(self.objects),
+            "puts": self.puts,
+            "parts": self.parts,
+            "openUploads": len(self.uploads),
+            "aborted": self.aborted,
+            "largestBody": self.largestBody,
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-memory S3 stand-in")
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+
+    s3 = FakeS3(args.port)
+    print("Fake S3 on", s3.url)
+    s3.server.serve_forever()
@@ -1,30 +1,50 @@
 import os
 import time
-import asyncio
+import random
+from aio import run
 from db import DB
+from journal import Journal
 from bucket import Bucket
+from catalog import SongCatalog
+from songcache import SongCache
 
 # Instances
 bucket = Bucket()
+# Shards keep separate caches, a shard must not evict files another one has pinned
+songCache = SongCache(
+    bucket,
+    directory=os.getenv("SONG_CACHE_DIR", "temp/cache"),
+    maxBytes=int(os.getenv("SONG_CACHE_MB", 512)) * 1024 * 1024 // int(os.getenv("SHARDS", 1))
+)
 
 # Databases
 db = DB("db/games.db")
 songsDB = DB("db/downloader.db")
 
+# Song catalog, loaded once per process
+catalog = SongCatalog(songsDB)
+
+# winner: True if user1 wins,
+#         False if user2 wins
+db.execute_query('''CREATE TABLE IF NOT EXISTS games (
+                    id VARCHAR PRIMARY KEY,
+                    u1 TEXT,
+                    u2 TEXT,
+                    bet DOUBLE,
+                    answer VARCHAR,
+                    ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    winner BOOLEAN,
+                    status VARCHAR DEFAULT "playing")''')
+
+db.execute_query("CREATE INDEX IF NOT EXISTS games_u1 ON games (u1)")
+db.execute_query("CREATE INDEX IF NOT EXISTS games_u2 ON games (u2)")
+db.execute_query("CREATE INDEX IF NOT EXISTS games_status ON games (status)")
+
+# Game bookkeeping is written behind, in batches
+journal = Journal(db, "games")
+
 class Game:
     def __init__(self, id):
-        # winner: True if user1 wins,
-        #         False if user2 wins
-        db.execute_query('''CREATE TABLE IF NOT EXISTS games (
-                            id VARCHAR PRIMARY KEY,
-                            u1 TEXT,
-                            u2 TEXT,
-                            bet DOUBLE,
-                            answer VARCHAR,
-                            ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            winner BOOLEAN,
-                            status VARCHAR DEFAULT "playing")''')
-
         self.songsPoolTitles = []
         self.activeQuestion = 0
         self.correctSong = None
@@ -33,13 +53,15 @@ class Game:
         self.betAmount = 0
         self.answered = []
         self.players = []
+        self.ended = False
+        self.songPath = None
+        self.cachedSong = None
         self.id = id
         self.ts = 0
 
     def createEmptyGame(self, players, betAmount):
         # Insert the game into the database
-        db.insert("games", {
-            "id": self.id,
+        journal.insert(self.id, {
             "u1": players[0],
             "u2": players[1],
             "bet": betAmount,
@@ -58,27 +80,20 @@ class Game:
             "answer": self.correctSong,
         }
 
-        db.update("games", gameObj, "id = ?", (self.id,))
+        journal.update(self.id, gameObj)
 
     async def end(self):
-        path = f"temp/temp_{self.correctSong}.mp3"
-
-        # Check path, if not exists, it means the method is already called
-        if not os.path.exists(path):
+        # The method is called by both players, only end once
+        if self.ended:
             return
+        self.ended = True
 
         # Update game in DB
         gameObj = {
             "winner": True if self.winner == self.players[0] else False,
             "status": "finished"
         }
-        db.update("games", gameObj, "id = ?", (self.id,))
-
-        # Delete the temporary file
-        async def removeTempFile():
-            await asyncio.sleep(120)
-            os.remove(path)
-        asyncio.create_task(removeTempFile())
+        journal.update(self.id, gameObj)
 
     def setWinner(self, winner):
         self.winner = winner
@@ -95,8 +110,7 @@ class Game:
             notList = True
 
         for song in pool:
-            songData = songsDB.fetch_one("SELECT title FROM songs WHERE id = ?", (song,))
-            newPool.append(songData["title"])
+            newPool.append(catalog.title(song))
 
         self.songsPoolTitles = newPool
 
@@ -104,26 +118,36 @@ class Game:
         return newPool
 
     def artistOfSong(self, song):
-        songData = songsDB.fetch_one("SELECT artist FROM songs WHERE id = ?", (song,))
-        return songData["artist"]
-
-    @staticmethod
-    def getGameIDFromPlayers(instances, players):
-        if type(players) != list:
-            players = [players]
-        for instance in instances:
-            for player in players:
-                if player not in instance.players:
-                    break
-            else:
-                return instance.id
-        return None
+        return catalog.artist(song)
 
     @staticmethod
-    def loadSongs():
-        songs = songsDB.fetch_all("SELECT id FROM songs")
-        return [song["id"] for song in songs]
+    def loadCatalog():
+        added = catalog.load()
+        print("Songs loaded:", added)
 
     @staticmethod
-    def downloadSong(song, path):
-        bucket.downloadFile(f"songs/{song}.mp3", path)
\ No newline at end of file
+    def pickSongs(choices=5):
+        """Pick a correct song and a shuffled pool of choices from the catalog."""
+        correctSong = catalog.randomSong()
+        songsPool = catalog.sample(choices - 1, exclude=correctSong) + [correctSong]
+        random.shuffle(songsPool)
+        return correctSong, songsPool
+
+    async def acquireSong(self, song):
+        # Pin the song in the local cache for the lifetime of the game
+        if not self.songPath:
+            self.songPath = await run(songCache.acquire, song)
+            self.cachedSong = song
+        return self.songPath
+
+    def useRound(self, round):
+        # Take over the round's pinned song and resolved titles
+        self.songPath = round.path
+        self.cachedSong = round.correctSong if round.path else None
+        self.songsPoolTitles = round.titles
+        round.path = None
+
+    def releaseSong(self):
+        if self.songPath:
+            songCache.release(self.cachedSong)
+            self.songPath = None
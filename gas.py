@@ -0,0 +1,92 @@
+"""
+Gas pricing for outgoing transfers, sampled from recent blocks instead of hard-coded.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from aio import run
+
+logger = logging.getLogger(__name__)
+
+TRANSFER_GAS = 21000 # Plain value transfer to an EOA
+
+class GasOracle:
+    def __init__(self, web3, refreshInterval: float = 30, blocks: int = 20, percentile: int = 50, minPrice: int = None, maxPrice: int = None):
+        self.web3 = web3
+        self.refreshInterval = refreshInterval
+        self.blocks = blocks
+        self.percentile = percentile
+        self.minPrice = minPrice if minPrice is not None else web3.to_wei('0.1', 'gwei')
+        self.maxPrice = maxPrice if maxPrice is not None else web3.to_wei('20', 'gwei')
+
+        self.price = None
+        self.updated = 0
+        self.limits = {} # recipient -> gas limit
+        self.lock = threading.Lock()
+        self.task = None
+
+    def refresh(self):
+        """Recommend a gas price from the fee history of the last blocks, in wei."""
+        try:
+            history = self.web3.eth.fee_history(self.blocks, "latest", [self.percentile])
+            rewards = sorted(reward[0] for reward in history["reward"] if reward)
+            tip = rewards[len(rewards) // 2] if rewards else 0
+            price = history["baseFeePerGas"][-1] + tip
+        except Exception:
+            # Node without eth_feeHistory
+            price = self.web3.eth.gas_price
+
+        price = min(max(price, self.minPrice), self.maxPrice)
+
+        with self.lock:
+            self.price = price
+            self.updated = time.time()
+        return price
+
+    def gasPrice(self):
+        with self.lock:
+            price = self.price
+            stale = time.time() - self.updated > self.refreshInterval * 4
+
+        # Background refresh is not running or fell behind
+        if price is None or stale:
+            price = self.refresh()
+        return price
+
+    def gasLimit(self, transaction: dict):
+        recipient = transaction["to"]
+
+        with self.lock:
+            limit = self.limits.get(recipient)
+        if limit:
+            return limit
+
+        if not self.web3.eth.get_code(recipient):
+            limit = TRANSFER_GAS
+        else:
+            limit = self.web3.eth.estimate_gas(transaction)
+
+        with self.lock:
+            self.limits[recipient] = limit
+        return limit
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.sample())
+        return self.task
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def sample(self):
+        while True:
+            try:
+                await run(self.refresh)
+            except Exception as e:
+                logger.warning("Gas price refresh failed: %s", e)
+
+            await asyncio.sleep(self.refreshInterval)
@@ -0,0 +1,96 @@
+"""
+Write-behind journal: row changes are coalesced in memory and flushed in batched transactions.
+"""
+
+import asyncio
+import logging
+from aio import run
+from db import DB
+
+logger = logging.getLogger(__name__)
+
+class Journal:
+    def __init__(self, db: DB, table: str, key: str = "id", flushInterval: float = 1, maxPending: int = 200):
+        self.db = db
+        self.table = table
+        self.key = key
+        self.flushInterval = flushInterval
+        self.maxPending = maxPending
+
+        self.pending = {} # key -> {"new": bool, "data": dict}
+        self.wake = asyncio.Event()
+        self.task = None
+
+        self.flushes = 0
+        self.rows = 0
+
+    def insert(self, key, data: dict):
+        self.pending[key] = {"new": True, "data": dict(data)}
+        self.changed()
+
+    def update(self, key, data: dict):
+        # Later changes to the same row merge into the pending one
+        entry = self.pending.setdefault(key, {"new": False, "data": {}})
+        entry["data"].update(data)
+        self.changed()
+
+    def changed(self):
+        if len(self.pending) >= self.maxPending:
+            self.wake.set()
+
+    def write(self, entries: dict):
+        with self.db.transaction():
+            for key, entry in entries.items():
+                if entry["new"]:
+                    self.db.insert(self.table, {self.key: key, **entry["data"]})
+                elif entry["data"]:
+                    self.db.update(self.table, entry["data"], f"{self.key} = ?", (key,))
+
+    async def flush(self):
+        if not self.pending:
+            return 0
+
+        entries, self.pending = self.pending, {}
+        try:
+            await run(self.write, entries)
+        except Exception:
+            # Put the batch back under anything that changed meanwhile
+            for key, entry in entries.items():
+                newer = self.pending.get(key)
+                if newer:
+                    entry["data"].update(newer["data"])
+                    entry["new"] = entry["new"] or newer["new"]
+                self.pending[key] = entry
+            raise
+
+        self.flushes += 1
+        self.rows += len(entries)
+        return len(entries)
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.flusher())
+        return self.task
+
+    async def flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.flushInterval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("Flushing %s failed: %s", self.table, e)
+
+    async def close(self):
+        """Stop the flusher and write everything still pending."""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+    def stats(self):
+        return {"pending": len(self.pending), "flushes": self.flushes, "rows": self.rows}
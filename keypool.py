@@ -0,0 +1,114 @@
+"""
+Pre-generated wallet keys, so a user's first deposit or match doesn't pay for key creation.
+"""
+
+import time
+import asyncio
+import logging
+from aio import run
+from db import DB
+from web3 import Account
+
+logger = logging.getLogger(__name__)
+
+class KeyPool:
+    def __init__(self, db: DB, size: int = 100, batch: int = 20, refillInterval: float = 5):
+        self.db = db
+        self.size = size
+        self.batch = batch
+        self.refillInterval = refillInterval
+        self.task = None
+
+        self.claims = 0
+        self.misses = 0
+        self.generated = 0
+        self.refillRate = 0 # Keys per second during the last refill
+
+        self.db.execute_query('''CREATE TABLE IF NOT EXISTS wallet_pool (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            private_key TEXT NOT NULL,
+                            address TEXT NOT NULL UNIQUE)''')
+
+    def depth(self):
+        return self.db.fetch_one("SELECT COUNT(*) AS depth FROM wallet_pool")["depth"]
+
+    def claim(self, uid):
+        """
+        Atomically move a pooled key to the user's wallet.
+        :return: The wallet, or None if the pool is empty
+        """
+        while True:
+            with self.db.transaction() as cursor:
+                cursor.execute("SELECT id, private_key, address FROM wallet_pool ORDER BY id LIMIT 1")
+                key = cursor.fetchone()
+                if not key:
+                    self.misses += 1
+                    return None
+
+                # Another bot process may have claimed the same key first
+                cursor.execute("DELETE FROM wallet_pool WHERE id = ?", (key["id"],))
+                if not cursor.rowcount:
+                    continue
+
+                cursor.execute(
+                    "INSERT INTO wallets (uid, private_key, address) VALUES (?, ?, ?)",
+                    (uid, key["private_key"], key["address"])
+                )
+                break
+
+        self.claims += 1
+        return {"address": key["address"], "private_key": key["private_key"]}
+
+    def generate(self, count):
+        keys = []
+        for _ in range(count):
+            account = Account.create()
+            keys.append((account.key.hex(), account.address))
+
+        with self.db.transaction() as cursor:
+            cursor.executemany("INSERT INTO wallet_pool (private_key, address) VALUES (?, ?)", keys)
+
+        self.generated += count
+
+    def refill(self):
+        """Top the pool up to its size, in batches of one commit each."""
+        missing = self.size - self.depth()
+        if missing <= 0:
+            return 0
+
+        started = time.perf_counter()
+        for i in range(0, missing, self.batch):
+            self.generate(min(self.batch, missing - i))
+
+        self.refillRate = missing / max(time.perf_counter() - started, 1e-9)
+        return missing
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.keepFilled())
+        return self.task
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def keepFilled(self):
+        while True:
+            try:
+                added = await run(self.refill)
+                if added:
+                    logger.info("Wallet pool refilled with %d keys", added)
+            except Exception as e:
+                logger.warning("Wallet pool refill failed: %s", e)
+
+            await asyncio.sleep(self.refillInterval)
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "claims": self.claims,
+            "misses": self.misses,
+            "generated": self.generated,
+            "refillRate": self.refillRate,
+        }
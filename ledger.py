@@ -0,0 +1,193 @@
+import time
+import sqlite3
+from db import DB
+from decimal import Decimal
+
+WEI = 10 ** 18
+
+def toWei(amount):
+    return int(Decimal(str(amount)) * WEI)
+
+def fromWei(wei):
+    return Decimal(wei) / WEI
+
+class InsufficientFunds(ValueError):
+    pass
+
+class Ledger:
+    """
+    Double-entry ledger of user funds, amounts are in wei.
+    Every movement is one ledger transaction whose entries sum to zero, written in a single commit.
+
+    Accounts:
+        user:<uid>         Spendable balance of a user
+        escrow:<gameID>    Bets locked for a running game
+        house:fees         Fees cut from settled games
+        chain:deposits     Funds that came in on-chain
+        chain:withdrawals  Funds that left on-chain
+    """
+    def __init__(self, db: DB):
+        self.db = db
+
+        self.db.execute_query('''CREATE TABLE IF NOT EXISTS ledger_transactions (
+                            id TEXT PRIMARY KEY,
+                            kind TEXT NOT NULL,
+                            ref TEXT,
+                            ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+        self.db.execute_query('''CREATE TABLE IF NOT EXISTS ledger_entries (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            tx TEXT NOT NULL,
+                            account TEXT NOT NULL,
+                            amount INTEGER NOT NULL)''')
+
+        self.db.execute_query('''CREATE TABLE IF NOT EXISTS ledger_accounts (
+                            account TEXT PRIMARY KEY,
+                            balance INTEGER NOT NULL DEFAULT 0)''')
+
+        self.db.execute_query("CREATE INDEX IF NOT EXISTS ledger_entries_account ON ledger_entries (account)")
+        self.db.execute_query("CREATE INDEX IF NOT EXISTS ledger_entries_tx ON ledger_entries (tx)")
+
+    def post(self, cursor: sqlite3.Cursor, txID: str, kind: str, ref: str, moves: list) -> bool:
+        """
+        Write a ledger transaction inside an open DB.transaction().
+        :param moves: List of (account, amount) pairs, must sum to zero
+        :return: False if the transaction was already posted
+        """
+        if sum(amount for _, amount in moves) != 0:
+            raise ValueError("Ledger entries must balance.")
+
+        try:
+            cursor.execute("INSERT INTO ledger_transactions (id, kind, ref) VALUES (?, ?, ?)", (txID, kind, ref))
+        except sqlite3.IntegrityError:
+            return False
+
+        for account, amount in moves:
+            if amount == 0: continue
+
+            cursor.execute(
+                "INSERT INTO ledger_entries (tx, account, amount) VALUES (?, ?, ?)",
+                (txID, account, amount)
+            )
+            cursor.execute(
+                '''INSERT INTO ledger_accounts (account, balance) VALUES (?, ?)
+                   ON CONFLICT(account) DO UPDATE SET balance = balance + excluded.balance''',
+                (account, amount)
+            )
+
+            # Only the chain accounts may go negative
+            if amount < 0 and not account.startswith("chain:"):
+                cursor.execute("SELECT balance FROM ledger_accounts WHERE account = ?", (account,))
+                if cursor.fetchone()[0] < 0:
+                    raise InsufficientFunds(f"Insufficient funds: {account}")
+
+        return True
+
+    def accountBalance(self, account) -> int:
+        row = self.db.fetch_one("SELECT balance FROM ledger_accounts WHERE account = ?", (account,))
+        return row["balance"] if row else 0
+
+    def balance(self, uid) -> Decimal:
+        """Spendable balance of a user in BNB."""
+        return fromWei(self.accountBalance(f"user:{uid}"))
+
+    def balances(self, uids: list) -> dict:
+        """Spendable balances of many users in BNB, keyed by uid as a string."""
+        balances = {str(uid): Decimal(0) for uid in uids}
+        accounts = [f"user:{uid}" for uid in balances]
+
+        # Stay below SQLite's bound parameter limit
+        for i in range(0, len(accounts), 500):
+            chunk = accounts[i:i + 500]
+            rows = self.db.fetch_all(
+                f"SELECT account, balance FROM ledger_accounts WHERE account IN ({', '.join(['?'] * len(chunk))})",
+                chunk
+            )
+            for row in rows:
+                balances[row["account"][len("user:"):]] = fromWei(row["balance"])
+        return balances
+
+    def postDeposit(self, cursor: sqlite3.Cursor, uid, wei: int, ref: str) -> bool:
+        """Credit an on-chain deposit inside an open DB.transaction(), once per ref."""
+        return self.post(cursor, f"deposit:{ref}", "deposit", ref, [
+            ("chain:deposits", -wei),
+            (f"user:{uid}", wei),
+        ])
+
+    def creditDeposit(self, uid, wei: int, ref: str) -> bool:
+        with self.db.transaction() as cursor:
+            return self.postDeposit(cursor, uid, wei, ref)
+
+    def escrow(self, gameID, players: list, amount):
+        """Lock every player's bet for a game, all or nothing."""
+        wei = toWei(amount)
+        moves = [(f"user:{player}", -wei) for player in players]
+        moves.append((f"escrow:{gameID}", wei * len(players)))
+
+        with self.db.transaction() as cursor:
+            return self.post(cursor, f"escrow:{gameID}", "escrow", gameID, moves)
+
+    def settle(self, gameID, winner, fee):
+        """Pay the escrowed pot to the winner, minus the house fee."""
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT balance FROM ledger_accounts WHERE account = ?", (f"escrow:{gameID}",))
+            row = cursor.fetchone()
+            pot = row[0] if row else 0
+            if pot <= 0:
+                return False
+
+            feeWei = min(toWei(fee), pot)
+            return self.post(cursor, f"settle:{gameID}", "settle", gameID, [
+                (f"escrow:{gameID}", -pot),
+                (f"user:{winner}", pot - feeWei),
+                ("house:fees", feeWei),
+            ])
+
+    def refund(self, gameID):
+        """Return whatever is still escrowed for a game to the players who put it in."""
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                "SELECT account, amount FROM ledger_entries WHERE tx = ? AND amount < 0",
+                (f"escrow:{gameID}",)
+            )
+            stakes = cursor.fetchall()
+
+            cursor.execute("SELECT balance FROM ledger_accounts WHERE account = ?", (f"escrow:{gameID}",))
+            row = cursor.fetchone()
+            if not stakes or not row or row[0] <= 0:
+                return False
+
+            moves = [(account, -amount) for account, amount in stakes]
+            moves.append((f"escrow:{gameID}", sum(amount for _, amount in stakes)))
+            return self.post(cursor, f"refund:{gameID}", "refund", gameID, moves)
+
+    def abandonedEscrows(self, before: float) -> list:
+        """Games whose bets were escrowed before the given unix time and are still held."""
+        rows = self.db.fetch_all(
+            '''SELECT a.account FROM ledger_accounts a
+               JOIN ledger_transactions t ON t.id = a.account
+               WHERE a.account LIKE 'escrow:%' AND a.balance > 0 AND t.ts < ?''',
+            (time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(before)),)
+        )
+        return [row["account"][len("escrow:"):] for row in rows]
+
+    def withdraw(self, uid, amount, ref: str):
+        """Take a withdrawal out of the user's balance before it is sent on-chain."""
+        wei = toWei(amount)
+        if wei <= 0:
+            raise ValueError("Invalid amount.")
+
+        with self.db.transaction() as cursor:
+            return self.post(cursor, f"withdraw:{ref}", "withdraw", ref, [
+                (f"user:{uid}", -wei),
+                ("chain:withdrawals", wei),
+            ])
+
+    def reverseWithdraw(self, uid, amount, ref: str):
+        """Give the funds back when the on-chain transfer could not be sent."""
+        wei = toWei(amount)
+        with self.db.transaction() as cursor:
+            return self.post(cursor, f"withdraw-reversed:{ref}", "withdraw-reversed", ref, [
+                ("chain:withdrawals", -wei),
+                (f"user:{uid}", wei),
+            ])
@@ -1,6 +1,7 @@
+import os
 import logging
 import asyncio
-from bot import Bot
+from shards import Front
 from multiprocessing import Process
 from downloader import main as Downloader
 
@@ -12,11 +13,20 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+def run_bot():
+    shards = int(os.getenv("SHARDS", 1))
+    if shards > 1:
+        Front(shards).run()
+    else:
+        # Imported here so a sharded front doesn't load the bot's wallets and databases
+        from bot import Bot
+        Bot()
+
 def run_downloader():
     asyncio.run(Downloader())
 
 if __name__ == "__main__":
-    p1 = Process(target=Bot)
+    p1 = Process(target=run_bot)
     p2 = Process(target=run_downloader)
 
     p1.start()
@@ -0,0 +1,175 @@
+"""
+Outbound Telegram queue with per-chat and global rate limits and priority lanes.
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+from itertools import count
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, lower goes first
+HIGH = 0 # Answer results, song delivery
+NORMAL = 1
+LOW = 2 # Countdown ticks
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blockedUntil = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available, 0 if one is available now."""
+        if now < self.blockedUntil:
+            return self.blockedUntil - now
+
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        # Telegram asked us to back off (RetryAfter)
+        self.blockedUntil = max(self.blockedUntil, time.monotonic() + seconds)
+
+    def idle(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity and now >= self.blockedUntil
+
+class Job:
+    __slots__ = ("chat", "send", "future", "retries")
+
+    def __init__(self, chat, send, future):
+        self.chat = chat
+        self.send = send # Zero-argument coroutine function doing the API call
+        self.future = future
+        self.retries = 0
+
+class Outbox:
+    def __init__(self, globalRate: float = 30, chatRate: float = 1, chatBurst: float = 3, maxRetries: int = 3):
+        self.globalBucket = TokenBucket(globalRate, globalRate)
+        self.chatRate = chatRate
+        self.chatBurst = chatBurst
+        self.maxRetries = maxRetries
+
+        self.chats = {} # chat -> TokenBucket
+        self.heap = [] # (priority, seq, job)
+        self.seq = count()
+        self.wake = asyncio.Event()
+        self.task = None
+
+        self.sent = 0
+        self.retried = 0
+
+    def bucket(self, chat):
+        if chat not in self.chats:
+            # Forget chats that are idle again
+            if len(self.chats) > 10000:
+                now = time.monotonic()
+                self.chats = {key: bucket for key, bucket in self.chats.items() if not bucket.idle(now)}
+            self.chats[chat] = TokenBucket(self.chatRate, self.chatBurst)
+        return self.chats[chat]
+
+    async def send(self, chat, send, priority=NORMAL):
+        """Queue an API call for a chat and wait for its result."""
+        self.start()
+
+        job = Job(chat, send, asyncio.get_running_loop().create_future())
+        self.push(job, priority)
+        return await job.future
+
+    def push(self, job: Job, priority):
+        heapq.heappush(self.heap, (priority, next(self.seq), job))
+        self.wake.set()
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.dispatch())
+        return self.task
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def dispatch(self):
+        while True:
+            if not self.heap:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+
+            now = time.monotonic()
+            wait = self.globalBucket.delay(now)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+
+            # Highest priority job whose chat has a token, others keep their place
+            entry = None
+            skipped = []
+            soonest = None
+            while self.heap:
+                candidate = heapq.heappop(self.heap)
+                delay = self.bucket(candidate[2].chat).delay(now)
+                if not delay:
+                    entry = candidate
+                    break
+                skipped.append(candidate)
+                soonest = delay if soonest is None else min(soonest, delay)
+
+            for candidate in skipped:
+                heapq.heappush(self.heap, candidate)
+
+            if not entry:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), soonest)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            priority, _, job = entry
+            self.globalBucket.take()
+            self.bucket(job.chat).take()
+            asyncio.create_task(self.deliver(job, priority))
+
+    async def deliver(self, job: Job, priority):
+        try:
+            result = await job.send()
+        except RetryAfter as e:
+            retryAfter = e.retry_after
+            retryAfter = retryAfter.total_seconds() if hasattr(retryAfter, "total_seconds") else float(retryAfter)
+            self.bucket(job.chat).block(retryAfter)
+
+            job.retries += 1
+            if job.retries <= self.maxRetries:
+                self.retried += 1
+                self.push(job, priority)
+            elif not job.future.done():
+                job.future.set_exception(e)
+            return
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+
+        self.sent += 1
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def stats(self):
+        return {"queued": len(self.heap), "sent": self.sent, "retried": self.retried, "chats": len(self.chats)}
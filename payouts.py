@@ -0,0 +1,243 @@
+"""
+Outgoing transfers: local nonce allocation, a per-address payout queue and receipt tracking.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from aio import run
+from gas import TRANSFER_GAS
+
+logger = logging.getLogger(__name__)
+
+class NonceManager:
+    """Hands out nonces per sender address, only asking the node on first use or after an error."""
+    def __init__(self, web3):
+        self.web3 = web3
+        self.nonces = {} # address -> next nonce
+        self.lock = threading.Lock()
+
+    def allocate(self, address):
+        with self.lock:
+            if address not in self.nonces:
+                self.nonces[address] = self.web3.eth.get_transaction_count(address, "pending")
+
+            nonce = self.nonces[address]
+            self.nonces[address] += 1
+            return nonce
+
+    def reset(self, address):
+        # Local view is off (failed send, tx sent elsewhere), resync on next allocation
+        with self.lock:
+            self.nonces.pop(address, None)
+
+class PayoutQueue:
+    """
+    Runs withdrawals through one worker per sender address.
+    Sends from the same address are serialized so nonces go out in order,
+    different addresses are processed in parallel.
+    """
+    def __init__(self, wallet):
+        self.wallet = wallet
+        self.queues = {} # sender address -> asyncio.Queue
+        self.workers = {}
+
+    async def submit(self, uid, recipientAddress, amount):
+        """Queue a withdrawal and wait until it is broadcast. Returns {"tx_hash": ...}."""
+        sender = self.wallet.mainAddress
+
+        if sender not in self.queues:
+            self.queues[sender] = asyncio.Queue()
+            self.workers[sender] = asyncio.create_task(self.work(self.queues[sender]))
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queues[sender].put((future, uid, recipientAddress, amount))
+        return await future
+
+    async def work(self, queue: asyncio.Queue):
+        while True:
+            future, uid, recipientAddress, amount = await queue.get()
+            try:
+                result = await run(self.wallet.withdraw, uid, recipientAddress, amount)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                queue.task_done()
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.cancel()
+        self.workers = {}
+        self.queues = {}
+
+class ReceiptTracker:
+    """
+    Polls receipts of pending transactions and settles them in the transactions table.
+    A transaction without a receipt after maxPendingAge seconds is rebroadcast while its nonce
+    is still open, and failed once the nonce was used by another transaction.
+    """
+    def __init__(self, wallet, pollInterval: float = 5, maxPendingAge: float = 600, onReceipt=None):
+        self.wallet = wallet
+        self.pollInterval = pollInterval
+        self.maxPendingAge = maxPendingAge
+        self.onReceipt = onReceipt # async callback(uid, tx hash, amount, confirmed)
+        self.task = None
+
+        self.rebroadcasts = 0
+        self.dropped = 0
+
+    def check(self):
+        """
+        Look up receipts for every pending transaction.
+        :return: List of (uid, tx hash, amount, confirmed) that were settled
+        """
+        pending = self.wallet.db.fetch_all(
+            "SELECT tx_hash, uid, amount, ref, nonce, raw, sent FROM transactions WHERE status = ? AND ref IS NOT NULL",
+            ("pending",)
+        )
+
+        settled = []
+        latest = None
+        for tx in pending:
+            receipt = self.wallet.getReceipt(tx["tx_hash"])
+            if receipt is None:
+                # Rows from before nonces were recorded can only wait for their receipt
+                if tx["raw"] is None or time.time() - (tx["sent"] or 0) < self.maxPendingAge:
+                    continue
+
+                if latest is None:
+                    main = self.wallet.mainAddress
+                    latest = self.wallet.rpc.getTransactionCounts([main], "latest")[main]
+
+                if tx["nonce"] >= latest:
+                    # Nonce still open, the node may have dropped it from the mempool
+                    try:
+                        self.wallet.rebroadcast(tx["tx_hash"], tx["raw"])
+                        self.rebroadcasts += 1
+                    except Exception as e:
+                        logger.warning("Rebroadcast of %s failed: %s", tx["tx_hash"], e)
+                    continue
+
+                # The nonce was mined, by this transaction since the first lookup or by another one
+                receipt = self.wallet.getReceipt(tx["tx_hash"])
+                if receipt is None:
+                    self.wallet.settleTransaction(tx["tx_hash"], tx["uid"], tx["amount"], tx["ref"], False, None)
+                    settled.append((tx["uid"], tx["tx_hash"], tx["amount"], False))
+                    self.dropped += 1
+                    continue
+
+            confirmed = receipt["status"] == 1
+            self.wallet.settleTransaction(tx["tx_hash"], tx["uid"], tx["amount"], tx["ref"], confirmed, receipt["blockNumber"])
+            settled.append((tx["uid"], tx["tx_hash"], tx["amount"], confirmed))
+
+        return settled
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.track())
+        return self.task
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def track(self):
+        while True:
+            try:
+                settled = await run(self.check)
+            except Exception as e:
+                logger.warning("Receipt check failed: %s", e)
+                settled = []
+
+            if self.onReceipt:
+                for receipt in settled:
+                    try:
+                        await self.onReceipt(*receipt)
+                    except Exception as e:
+                        logger.warning("Receipt notification failed: %s", e)
+
+            await asyncio.sleep(self.pollInterval)
+
+    def stats(self):
+        return {"rebroadcasts": self.rebroadcasts, "dropped": self.dropped}
+
+class Sweeper:
+    """
+    Moves deposits from users' addresses to the main wallet, which pays every withdrawal.
+    Addresses holding less than minBalance (in wei) are left until they collect more.
+    """
+    def __init__(self, wallet, interval: float = 600, minBalance: int = 0):
+        self.wallet = wallet
+        self.interval = interval
+        self.minBalance = minBalance
+        self.task = None
+
+        self.swept = 0
+        self.sweptWei = 0
+
+    def check(self):
+        """
+        Sweep every deposit address above the threshold.
+        :return: List of (uid, tx hash, wei) sent
+        """
+        rows = self.wallet.db.fetch_all("SELECT uid, address, private_key FROM wallets")
+        wallets = {row["address"]: row for row in rows}
+        if not wallets:
+            return []
+
+        gasPrice = self.wallet.gas.gasPrice()
+        fee = TRANSFER_GAS * gasPrice
+
+        balances = self.wallet.rpc.getBalances(list(wallets))
+        due = [address for address, wei in balances.items() if wei > max(self.minBalance, fee)]
+        if not due:
+            return []
+
+        # An earlier sweep still in the mempool, its nonce would be reused
+        busy = self.wallet.pendingAddresses(due)
+
+        swept = []
+        for address in due:
+            if address in busy: continue
+
+            wallet, wei = wallets[address], balances[address] - fee
+            try:
+                tx_hash = self.wallet.sweep(wallet["uid"], address, wallet["private_key"], wei, gasPrice)
+            except Exception as e:
+                logger.warning("Sweep of %s failed: %s", address, e)
+                continue
+
+            swept.append((wallet["uid"], tx_hash, wei))
+            self.sweptWei += wei
+
+        self.swept += len(swept)
+        return swept
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.sweep())
+        return self.task
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def sweep(self):
+        while True:
+            try:
+                swept = await run(self.check)
+                if swept:
+                    logger.info("Swept %d deposit addresses", len(swept))
+            except Exception as e:
+                logger.warning("Sweep failed: %s", e)
+
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {"swept": self.swept, "sweptWei": self.sweptWei}
@@ -0,0 +1,141 @@
+"""
+Staged asyncio pipeline: every stage has its own bounded queue and worker count,
+so a slow stage holds back only the work queued in front of it.
+"""
+
+import time
+import asyncio
+import logging
+from outbox import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Token bucket shared by every stage calling the same rate limited API."""
+    def __init__(self, rate: float, burst: float = 1):
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = asyncio.Lock()
+        self.acquired = 0
+        self.waited = 0
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                wait = self.bucket.delay(time.monotonic())
+                if not wait:
+                    break
+                self.waited += wait
+                await asyncio.sleep(wait)
+
+            self.bucket.take()
+            self.acquired += 1
+
+    def block(self, seconds: float):
+        # The API answered 429, nobody calls it until the window passes
+        self.bucket.block(seconds)
+
+    def stats(self):
+        return {"acquired": self.acquired, "waited": round(self.waited, 1)}
+
+class Stage:
+    def __init__(self, name: str, handler, workers: int = 1, queueSize: int = 100):
+        """
+        :param handler: Coroutine function taking an item and returning the list of items
+                        passed to the next stage
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = asyncio.Queue(queueSize)
+        self.next = None
+        self.tasks = []
+
+        self.processed = 0
+        self.emitted = 0
+        self.failed = 0
+        self.busy = 0 # Seconds spent inside the handler, summed over workers
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    async def work(self):
+        while True:
+            item = await self.queue.get()
+            started = time.perf_counter()
+            try:
+                results = await self.handler(item) or []
+            except Exception as e:
+                self.failed += 1
+                results = []
+                logger.warning("Stage %s failed on %s: %s", self.name, item, e)
+            finally:
+                self.busy += time.perf_counter() - started
+
+            try:
+                self.processed += 1
+                if self.next:
+                    for result in results:
+                        await self.next.queue.put(result)
+                        self.emitted += 1
+            finally:
+                self.queue.task_done()
+
+    def stats(self, elapsed: float):
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "queued": self.queue.qsize(),
+            "perSecond": round(self.processed / elapsed, 3) if elapsed else 0,
+            "utilization": round(self.busy / (elapsed * self.workers), 3) if elapsed else 0,
+        }
+
+class Pipeline:
+    def __init__(self, stages: list, reportInterval: float = 60):
+        self.stages = stages
+        self.reportInterval = reportInterval
+        self.started = None
+
+        for stage, following in zip(stages, stages[1:]):
+            stage.next = following
+
+    async def run(self, items, feeds: dict = None):
+        """
+        Feed items to the first stage and wait until every stage has drained.
+        :param feeds: Stage name -> items entering the pipeline at that stage
+        """
+        self.started = time.perf_counter()
+        for stage in self.stages:
+            stage.start()
+        reporter = asyncio.create_task(self.report())
+
+        try:
+            for item in items:
+                await self.stages[0].queue.put(item)
+            for stage in self.stages:
+                for item in (feeds or {}).get(stage.name, ()):
+                    await stage.queue.put(item)
+
+            # A stage only emits before marking its item done, so draining in order is enough
+            for stage in self.stages:
+                await stage.queue.join()
+        finally:
+            reporter.cancel()
+            for stage in self.stages:
+                stage.stop()
+
+        return self.stats()
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.reportInterval)
+            for name, stats in self.stats().items():
+                logger.info("%s: %s", name, stats)
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0
+        return {stage.name: stage.stats(elapsed) for stage in self.stages}
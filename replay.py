@@ -0,0 +1,388 @@
+"""
+Replays Telegram updates against the bot in webhook mode, with every outside service faked locally.
+
+Starts a fake Bot API server, a fake BSC node and an in-memory S3 holding the catalog's songs,
+runs bot.py with BOT_MODE=webhook and TELEGRAM_BASE_URL pointing at the fake, and POSTs each
+update to the bot's webhook with the secret token header, like Telegram does. Waits for the
+bot's reply to every update before stopping it, and reports the time until the webhook accepted
+an update, the time until the bot replied to it, the Bot API calls and how the games ended.
+
+    python replay.py updates.jsonl       # Recorded updates, one JSON object per line
+    python replay.py --players 20        # Generated players going through /start, a race and its answers
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from email.parser import BytesParser
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from fakes3 import FakeS3
+from benchmark import FakeBSC, seedCatalog, summary
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SECRET = "replay-secret"
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class FakeBotAPI:
+    """Bot API server on localhost answering every method, and remembering the answer keyboards sent to each chat."""
+    def __init__(self, port: int = 0):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.messageID = 0
+        self.keyboards = {} # chat -> answer options of the last keyboard sent
+        self.keyboardEvents = {} # chat -> threading.Event set when a keyboard arrives
+        self.messages = {} # chat -> [(perf_counter, text)] of every message sent to it
+        self.callbackAnswers = {} # callback query id -> perf_counter of answerCallbackQuery
+        self.replied = threading.Condition(self.lock)
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                method = urlparse(self.path).path.rsplit("/", 1)[-1]
+                result = api.handle(method, api.parse(self.headers.get("Content-Type", ""), body))
+
+                data = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def parse(self, contentType: str, body: bytes):
+        if contentType.startswith("multipart/form-data"):
+            # Uploads, e.g. sendVoice with the song file
+            message = BytesParser().parsebytes(b"Content-Type: " + contentType.encode() + b"\r\n\r\n" + body)
+            return {
+                part.get_param("name", header="content-disposition"):
+                    "<file>" if part.get_filename() else part.get_payload(decode=True).decode()
+                for part in message.get_payload()
+            }
+        if contentType.startswith("application/json"):
+            return json.loads(body or b"{}")
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+    def waitFor(self, found, timeout: float):
+        """Wait until found() returns something other than None, and return it."""
+        with self.replied:
+            return self.replied.wait_for(found, timeout)
+
+    def waitKeyboard(self, chat):
+        with self.lock:
+            return self.keyboardEvents.setdefault(chat, threading.Event())
+
+    def handle(self, method: str, params: dict):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "SongRival", "username": "SongRivalBot"}
+        if method == "answerCallbackQuery":
+            with self.replied:
+                self.callbackAnswers[params.get("callback_query_id")] = time.perf_counter()
+                self.replied.notify_all()
+            return True
+        if method not in ("sendMessage", "sendVoice", "editMessageText"):
+            return True
+
+        chat = int(params.get("chat_id"))
+        with self.replied:
+            self.messages.setdefault(chat, []).append((time.perf_counter(), params.get("text", "")))
+            self.replied.notify_all()
+            self.messageID += 1
+            result = {"message_id": self.messageID, "date": int(time.time()), "chat": {"id": chat, "type": "private"}}
+        if method == "sendVoice":
+            result["voice"] = {"file_id": f"voice{result['message_id']}", "file_unique_id": f"v{result['message_id']}", "duration": 30}
+        else:
+            result["text"] = params.get("text", "")
+
+        markup = params.get("reply_markup")
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        options = [button["callback_data"] for row in (markup or {}).get("inline_keyboard", []) for button in row]
+        if options and all(option.startswith("answer_") for option in options):
+            with self.lock:
+                self.keyboards[chat] = options
+            self.waitKeyboard(chat).set()
+
+        return result
+
+class Replayer:
+    def __init__(self, webhook: str, api: FakeBotAPI, delay: float, replyTimeout: float):
+        self.webhook = webhook
+        self.api = api
+        self.delay = delay
+        self.replyTimeout = replyTimeout
+        self.updateID = 0
+        self.lock = threading.Lock()
+
+        self.latency = [] # Until the webhook accepted the update
+        self.processing = [] # Until the bot's first reply to the update
+        self.unanswered = 0
+        self.statuses = {}
+
+    def post(self, update: dict):
+        """POST an update to the webhook, returns when it was sent."""
+        request = urllib.request.Request(
+            self.webhook,
+            data=json.dumps(update).encode(),
+            headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": SECRET},
+        )
+
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        elapsed = time.perf_counter() - started
+
+        with self.lock:
+            self.latency.append(elapsed)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+        return started
+
+    def messageAfter(self, chat, since, text: str = ""):
+        # Called by FakeBotAPI.waitFor with its lock held
+        return next((ts for ts, sent in self.api.messages.get(chat, []) if ts >= since and text in sent), None)
+
+    def awaitReply(self, update: dict, since: float):
+        """Wait for the bot's first reply to an update: the callback query's answer or a message to the chat."""
+        query = update.get("callback_query")
+        if query:
+            # Not every handler answers the query, some only send a message
+            chat = query["from"]["id"]
+            found = lambda: self.api.callbackAnswers.get(query["id"]) or self.messageAfter(chat, since)
+        else:
+            chat = ((update.get("message") or {}).get("chat") or {}).get("id")
+            found = lambda: self.messageAfter(chat, since)
+
+        replied = self.api.waitFor(found, self.replyTimeout)
+        with self.lock:
+            if replied is None:
+                self.unanswered += 1
+            else:
+                self.processing.append(replied - since)
+        return replied
+
+    def nextID(self):
+        with self.lock:
+            self.updateID += 1
+            return self.updateID
+
+    def message(self, player, text):
+        updateID = self.nextID()
+        message = {
+            "message_id": updateID,
+            "date": int(time.time()),
+            "chat": {"id": player, "type": "private"},
+            "from": {"id": player, "is_bot": False, "first_name": "Player"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": updateID, "message": message}
+
+    def callback(self, player, data):
+        updateID = self.nextID()
+        return {
+            "update_id": updateID,
+            "callback_query": {
+                "id": str(updateID),
+                "chat_instance": str(player),
+                "data": data,
+                "from": {"id": player, "is_bot": False, "first_name": "Player"},
+                "message": {
+                    "message_id": updateID,
+                    "date": int(time.time()),
+                    "chat": {"id": player, "type": "private"},
+                    "text": "",
+                },
+            },
+        }
+
+    def replay(self, updates):
+        posted = []
+        for update in updates:
+            posted.append((update, self.post(update)))
+            time.sleep(self.delay)
+
+        for update, since in posted:
+            self.awaitReply(update, since)
+
+    def player(self, player, timeout):
+        """
+        One generated player: /start, a free race, then an answer once the song arrives.
+        :return: Whether the player got the game's result
+        """
+        keyboard = self.api.waitKeyboard(player)
+        self.replay([self.message(player, "/start"), self.callback(player, "race"), self.callback(player, "bet_0")])
+
+        if not keyboard.wait(timeout):
+            return False
+
+        answer = self.callback(player, random.choice(self.api.keyboards[player]))
+        since = self.post(answer)
+        self.awaitReply(answer, since)
+
+        # Every outcome, win, loss or draw, ends with the same prompt
+        return self.api.waitFor(lambda: self.messageAfter(player, since, "Wanna play again"), timeout) is not None
+
+    def stats(self):
+        return {
+            "posted": len(self.latency),
+            "statuses": self.statuses,
+            "webhook": summary(self.latency),
+            "processing": summary(self.processing),
+            "unanswered": self.unanswered,
+        }
+
+def gameStatuses():
+    if not os.path.exists("db/games.db"):
+        return {}
+    db = sqlite3.connect("db/games.db")
+    try:
+        return dict(db.execute("SELECT status, COUNT(*) FROM games GROUP BY status").fetchall())
+    finally:
+        db.close()
+
+def waitForPort(port: int, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Telegram updates against the bot's webhook")
+    parser.add_argument("updates", nargs="?", help="JSONL file of recorded updates, generated players if left out")
+    parser.add_argument("--players", type=int, default=10, help="Generated players, paired into free races")
+    parser.add_argument("--songs", type=int, default=50, help="Size of the fake catalog")
+    parser.add_argument("--delay", type=float, default=0.05, help="Seconds between updates of the same sender")
+    parser.add_argument("--match-timeout", type=float, default=60, help="Seconds a player waits for the song, and then for the result")
+    parser.add_argument("--reply-timeout", type=float, default=10, help="Seconds to wait for the bot's reply to an update")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's output instead of logging it to the workdir")
+    args = parser.parse_args()
+
+    updates = None
+    if args.updates:
+        with open(args.updates) as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+
+    # The bot keeps its databases and song cache relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="songrival-replay-")
+    os.chdir(workdir)
+    os.makedirs("db")
+    os.makedirs("temp")
+    seedCatalog(args.songs)
+
+    api = FakeBotAPI().start()
+    bsc = FakeBSC()
+    s3 = FakeS3().start()
+    for i in range(args.songs):
+        s3.objects[("replay", f"songs/song{i}.mp3")] = b"\0" * 4096
+
+    port = freePort()
+    env = dict(
+        os.environ,
+        BOT_TOKEN="1:replay",
+        BOT_MODE="webhook",
+        SHARDS="1",
+        TELEGRAM_BASE_URL=f"{api.url}/bot",
+        WEBHOOK_URL=f"http://127.0.0.1:{port}/telegram",
+        WEBHOOK_LISTEN="127.0.0.1",
+        WEBHOOK_PORT=str(port),
+        WEBHOOK_PATH="telegram",
+        WEBHOOK_SECRET=SECRET,
+        BSC_RPC_URL=bsc.url,
+        DO_REGION="fake",
+        DO_BUCKET_NAME="replay",
+        DO_BUCKET_ENDPOINT=s3.url,
+        DO_ACCESS_KEY="fake",
+        DO_SECRET_KEY="fake",
+        DO_ADDRESSING_STYLE="path",
+        WALLET_POOL_SIZE="0",
+    )
+
+    log = None if args.verbose else open(os.path.join(workdir, "bot.log"), "w")
+    bot = subprocess.Popen([sys.executable, os.path.join(ROOT, "bot.py")], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    try:
+        if not waitForPort(port, bot, args.startup_timeout):
+            print("The bot did not open its webhook, see", os.path.join(workdir, "bot.log"))
+            sys.exit(1)
+
+        replayer = Replayer(f"http://127.0.0.1:{port}/telegram", api, args.delay, args.reply_timeout)
+        started = time.perf_counter()
+        if updates is not None:
+            replayer.replay(updates)
+            results = {}
+        else:
+            players = [10_000_000 + i for i in range(args.players)]
+            with ThreadPoolExecutor(max_workers=len(players)) as pool:
+                answered = list(pool.map(lambda player: replayer.player(player, args.match_timeout), players))
+            results = {"players": len(players), "finished": sum(answered)}
+
+        results.update(replayer.stats())
+        results["elapsed"] = time.perf_counter() - started
+        results["botAPICalls"] = dict(api.calls)
+        results["s3"] = s3.stats()
+        results["bscCalls"] = bsc.calls
+    finally:
+        # SIGTERM lets the bot shut down and flush its game journal
+        bot.terminate()
+        try:
+            bot.wait(30)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        api.stop()
+        s3.stop()
+        bsc.server.shutdown()
+        if log:
+            log.close()
+
+    results["games"] = gameStatuses()
+    print(json.dumps(results, indent=2))
+    if log:
+        print("Bot output in", log.name)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from aio import run
+from collections import deque
+from voicecache import VoiceCache
+from game import Game, catalog, songCache
+
+logger = logging.getLogger(__name__)
+
+class Round:
+    def __init__(self, correctSong, songsPool, titles, path):
+        self.correctSong = correctSong
+        self.songsPool = songsPool
+        self.titles = titles
+        self.path = path # Pinned in the song cache, None if Telegram has the file_id
+
+    def release(self):
+        if self.path:
+            songCache.release(self.correctSong)
+            self.path = None
+
+class RoundPool:
+    """
+    Keeps a few ready-to-play rounds so a match can start without waiting on the bucket.
+    A background producer refills the pool whenever a round is taken.
+    """
+    def __init__(self, voiceCache: VoiceCache, size: int = 4, refillDelay: float = 1):
+        self.voiceCache = voiceCache
+        self.size = size
+        self.refillDelay = refillDelay
+
+        self.rounds = deque()
+        self.wanted = asyncio.Event()
+        self.task = None
+
+        self.hits = 0
+        self.misses = 0
+
+    async def build(self):
+        correctSong, songsPool = Game.pickSongs()
+        titles = [catalog.title(song) for song in songsPool]
+
+        path = None
+        if not self.voiceCache.get(correctSong):
+            path = await run(songCache.acquire, correctSong)
+
+        return Round(correctSong, songsPool, titles, path)
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.produce())
+        return self.task
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+        while self.rounds:
+            self.rounds.popleft().release()
+
+    async def produce(self):
+        while True:
+            while len(self.rounds) >= self.size:
+                self.wanted.clear()
+                await self.wanted.wait()
+
+            try:
+                self.rounds.append(await self.build())
+            except Exception as e:
+                # Empty catalog or bucket errors, try again later
+                logger.warning("Could not prefetch a round: %s", e)
+                await asyncio.sleep(max(self.refillDelay, 10))
+                continue
+
+            await asyncio.sleep(self.refillDelay)
+
+    async def pop(self):
+        self.wanted.set()
+
+        if self.rounds:
+            self.hits += 1
+            return self.rounds.popleft()
+
+        # Pool drained, build the round inline
+        self.misses += 1
+        return await self.build()
+
+    def stats(self):
+        return {"ready": len(self.rounds), "hits": self.hits, "misses": self.misses}
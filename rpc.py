@@ -0,0 +1,67 @@
+"""
+Batched JSON-RPC client for bulk queries that would otherwise be one HTTP request per address.
+"""
+
+import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class RPCError(Exception):
+    pass
+
+class BatchRPC:
+    def __init__(self, url: str, batchSize: int = 100, concurrency: int = 4, timeout: float = 30):
+        self.url = url
+        self.batchSize = batchSize
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="rpc")
+        self.local = threading.local()
+
+    def session(self):
+        # requests.Session is not thread safe, keep one per worker for keep-alive
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def send(self, batch: list):
+        payload = [
+            {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+            for i, (method, params) in enumerate(batch)
+        ]
+
+        response = self.session().post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        replies = response.json()
+
+        # A node may reject the whole batch with a single error object
+        if isinstance(replies, dict):
+            raise RPCError(replies.get("error", replies))
+
+        results = [None] * len(batch)
+        for reply in replies:
+            if "error" in reply:
+                raise RPCError(reply["error"])
+            results[reply["id"]] = reply["result"]
+        return results
+
+    def call(self, calls: list):
+        """
+        Run many (method, params) calls as JSON-RPC batches of batchSize, several batches in parallel.
+        :return: Results in the same order as calls
+        """
+        batches = [calls[i:i + self.batchSize] for i in range(0, len(calls), self.batchSize)]
+
+        results = []
+        for batchResults in self.executor.map(self.send, batches):
+            results.extend(batchResults)
+        return results
+
+    def getBalances(self, addresses: list, block="latest"):
+        """Balances in wei, keyed by address."""
+        results = self.call([("eth_getBalance", [address, block]) for address in addresses])
+        return {address: int(result, 16) for address, result in zip(addresses, results)}
+
+    def getTransactionCounts(self, addresses: list, block="pending"):
+        """Nonces, keyed by address."""
+        results = self.call([("eth_getTransactionCount", [address, block]) for address in addresses])
+        return {address: int(result, 16) for address, result in zip(addresses, results)}
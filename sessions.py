@@ -0,0 +1,71 @@
+from itertools import count
+from collections import deque
+
+class SessionRegistry:
+    def __init__(self, bets: list):
+        # Matchmaking: FIFO queue per bet tier
+        # Leaving is O(1) by dropping the ticket, stale queue entries are skipped on pop
+        self.queues = {bet: deque() for bet in bets}
+        self.queueSizes = {bet: 0 for bet in bets}
+        self.queued = {} # uid -> (bet, ticket)
+        self.tickets = count()
+
+        # Games
+        self.playing = {} # uid -> gameID
+        self.games = {} # gameID -> [uid]
+
+    def queueOf(self, uid):
+        """Return the bet tier the user is queued in, or None."""
+        entry = self.queued.get(uid)
+        return entry[0] if entry else None
+
+    def joinQueue(self, uid, bet):
+        if uid in self.queued:
+            raise ValueError("User is already in the matchmaking pool.")
+
+        if bet not in self.queues:
+            self.queues[bet] = deque()
+            self.queueSizes[bet] = 0
+
+        ticket = next(self.tickets)
+        self.queued[uid] = (bet, ticket)
+        self.queues[bet].append((uid, ticket))
+        self.queueSizes[bet] += 1
+
+    def leaveQueue(self, uid):
+        """Remove user from matchmaking. Returns the bet tier left, or None."""
+        entry = self.queued.pop(uid, None)
+        if not entry:
+            return None
+
+        self.queueSizes[entry[0]] -= 1
+        return entry[0]
+
+    def popOpponent(self, bet):
+        """Pop the longest waiting user of a bet tier, or None if nobody is waiting."""
+        queue = self.queues.get(bet, ())
+        while queue:
+            uid, ticket = queue.popleft()
+            if self.queued.get(uid) == (bet, ticket):
+                del self.queued[uid]
+                self.queueSizes[bet] -= 1
+                return uid
+        return None
+
+    def gameOf(self, uid):
+        return self.playing.get(uid)
+
+    def addGame(self, gameID, players: list):
+        self.games[gameID] = list(players)
+        for player in players:
+            self.playing[player] = gameID
+
+    def removeGame(self, gameID):
+        players = self.games.pop(gameID, [])
+        for player in players:
+            if self.playing.get(player) == gameID:
+                del self.playing[player]
+        return players
+
+    def __repr__(self):
+        return f"SessionRegistry(queues={self.queueSizes}, games={len(self.games)})"
@@ -0,0 +1,155 @@
+"""
+Several bot processes on one box: a front process receives every update and routes it
+to a shard by user, and pairs players across shards for matchmaking.
+"""
+
+import os
+import asyncio
+import logging
+import multiprocessing
+from sessions import SessionRegistry
+from updates import runApplication
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+logger = logging.getLogger(__name__)
+
+class ShardLink:
+    """A shard's end of the IPC: its own inbox, and the front's inbox for matchmaking."""
+    def __init__(self, index: int, count: int, inbox, front):
+        self.index = index
+        self.count = count
+        self.inbox = inbox
+        self.front = front
+
+    def send(self, *message):
+        self.front.put(message)
+
+    async def receive(self):
+        # Blocking queue read, kept off the shared I/O pool
+        return await asyncio.get_running_loop().run_in_executor(None, self.inbox.get)
+
+    def cacheDirectory(self):
+        return os.path.join("temp", "cache", f"shard-{self.index}")
+
+def runShard(index: int, count: int, inbox, front):
+    link = ShardLink(index, count, inbox, front)
+
+    # Read by the song cache when game.py is imported
+    os.environ["SONG_CACHE_DIR"] = link.cacheDirectory()
+
+    # Imported here so the front process doesn't load the bot's wallets and databases
+    from bot import Bot
+    Bot(shard=link)
+
+class Front:
+    """
+    Routes a user's updates to shard uid % count, or to the shard owning their game
+    while one is running. Owns the matchmaking queues of every shard.
+
+    Shard -> front messages: ("join", shard, uid, bet), ("leave", shard, uid), ("unroute", players),
+                             ("withdraw", shard, requestID, uid, address, amount),
+                             ("withdrawn", shard, requestID, result, error)
+    Front -> shard messages: ("update", data), ("dequeued", uid), ("match", players, bet), ("stop",),
+                             ("withdraw", ...) to the first shard, ("withdrawn", requestID, result, error)
+    """
+    def __init__(self, count: int, token: str = None):
+        context = multiprocessing.get_context("spawn") # Shards open their own connections
+        self.count = count
+        self.inbox = context.Queue()
+        self.inboxes = [context.Queue() for _ in range(count)]
+        self.workers = [
+            context.Process(target=runShard, args=(i, count, self.inboxes[i], self.inbox), daemon=True)
+            for i in range(count)
+        ]
+
+        self.pool = SessionRegistry([])
+        self.homes = {} # uid -> shard the user queued from
+        self.routes = {} # uid -> shard owning the user's game
+        self.routed = [0] * count
+        self.matches = 0
+        self.task = None
+
+        builder = (
+            Application.builder()
+            .token(token or os.getenv("BOT_TOKEN"))
+            .post_init(self.postInit)
+            .post_shutdown(self.postShutdown)
+        )
+        if os.getenv("TELEGRAM_BASE_URL"):
+            builder.base_url(os.getenv("TELEGRAM_BASE_URL"))
+        self.application = builder.build()
+        self.application.add_handler(TypeHandler(Update, self.forward))
+
+    def run(self):
+        for worker in self.workers:
+            worker.start()
+        runApplication(self.application)
+
+    def shardOf(self, uid):
+        return self.routes.get(uid, uid % self.count)
+
+    async def forward(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat = update.effective_chat or update.effective_user
+        shard = self.shardOf(chat.id) if chat else 0
+        self.inboxes[shard].put(("update", update.to_dict()))
+        self.routed[shard] += 1
+
+    async def postInit(self, application: Application):
+        self.task = asyncio.create_task(self.coordinate())
+
+    async def postShutdown(self, application: Application):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+        for inbox in self.inboxes:
+            inbox.put(("stop",))
+        for worker in self.workers:
+            await asyncio.get_running_loop().run_in_executor(None, worker.join, 10)
+
+    async def coordinate(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self.inbox.get)
+            try:
+                self.handle(*message)
+            except Exception as e:
+                logger.warning("Shard message %s failed: %s", message, e)
+
+    def handle(self, kind, *args):
+        if kind == "join":
+            shard, uid, bet = args
+            rival = self.pool.popOpponent(bet)
+            if rival is None:
+                self.pool.joinQueue(uid, bet)
+                self.homes[uid] = shard
+                return
+
+            # The waiting player's shard owns the game, both players are routed there until it ends
+            owner = self.homes.pop(rival)
+            self.routes[rival] = self.routes[uid] = owner
+            self.inboxes[owner].put(("dequeued", rival))
+            self.inboxes[shard].put(("dequeued", uid))
+            self.inboxes[owner].put(("match", [rival, uid], bet))
+            self.matches += 1
+
+        elif kind == "leave":
+            shard, uid = args
+            self.pool.leaveQueue(uid)
+            self.homes.pop(uid, None)
+
+        elif kind == "unroute":
+            for uid in args[0]:
+                self.routes.pop(uid, None)
+
+        elif kind == "withdraw":
+            # The first shard holds the main wallet's nonces, it signs every payout
+            self.inboxes[0].put(("withdraw", *args))
+
+        elif kind == "withdrawn":
+            origin, *answer = args
+            self.inboxes[origin].put(("withdrawn", *answer))
+
+    def stats(self):
+        return {"routed": list(self.routed), "routes": len(self.routes), "matches": self.matches, "pool": repr(self.pool)}
@@ -0,0 +1,117 @@
+import os
+import threading
+from collections import OrderedDict
+from bucket import Bucket
+
+class SongCache:
+    def __init__(self, bucket: Bucket, directory: str = "temp/cache", maxBytes: int = 512 * 1024 * 1024):
+        self.bucket = bucket
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+        self.entries = OrderedDict() # song -> size, least recently used first
+        self.refs = {} # song -> number of live games using the file
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.lock = threading.Lock()
+        self.downloadLocks = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.scan()
+
+    def path(self, song):
+        return os.path.join(self.directory, f"{song}.mp3")
+
+    def scan(self):
+        """Rebuild the index from files left by a previous run, oldest first."""
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".mp3"): continue
+            filePath = os.path.join(self.directory, name)
+            stat = os.stat(filePath)
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+
+        for _, song, size in sorted(files):
+            self.entries[song] = size
+            self.size += size
+
+        with self.lock:
+            self.evict()
+
+    def acquire(self, song):
+        """
+        Return a local path for the song, downloading it on a miss.
+        The file is pinned until release() is called.
+        """
+        with self.lock:
+            self.refs[song] = self.refs.get(song, 0) + 1
+            downloadLock = self.downloadLocks.setdefault(song, threading.Lock())
+
+        try:
+            # Concurrent misses on the same song download once
+            with downloadLock:
+                with self.lock:
+                    cached = song in self.entries
+                    if cached:
+                        self.entries.move_to_end(song)
+                        self.hits += 1
+
+                if not cached:
+                    self.download(song)
+        except Exception:
+            self.release(song)
+            raise
+
+        return self.path(song)
+
+    def download(self, song):
+        path = self.path(song)
+        partial = f"{path}.part"
+
+        self.bucket.downloadFile(f"songs/{song}.mp3", partial)
+        os.replace(partial, path)
+        size = os.path.getsize(path)
+
+        with self.lock:
+            self.misses += 1
+            self.entries[song] = size
+            self.size += size
+            self.evict()
+
+    def release(self, song):
+        with self.lock:
+            refs = self.refs.get(song, 0) - 1
+            if refs > 0:
+                self.refs[song] = refs
+            else:
+                self.refs.pop(song, None)
+            self.evict()
+
+    def evict(self):
+        # Caller holds self.lock
+        for song in list(self.entries.keys()):
+            if self.size <= self.maxBytes: break
+            if self.refs.get(song): continue # In use by a live game
+
+            size = self.entries.pop(song)
+            self.size -= size
+            self.evictions += 1
+            self.downloadLocks.pop(song, None)
+
+            try: os.remove(self.path(song))
+            except FileNotFoundError: pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "files": len(self.entries),
+                "bytes": self.size,
+                "pinned": len(self.refs),
+            }
@@ -0,0 +1,100 @@
+"""
+One scheduler for every game deadline, instead of a sleeping task per player.
+"""
+
+import heapq
+import asyncio
+import logging
+from itertools import count
+
+logger = logging.getLogger(__name__)
+
+class Timer:
+    __slots__ = ("deadline", "callback", "args", "key", "cancelled")
+
+    def __init__(self, deadline, callback, args, key):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.key = key
+        self.cancelled = False
+
+class Scheduler:
+    """
+    Heap of deadlines served by a single task, which sleeps until the earliest one.
+    Timers can be grouped by key (a game ID) and cancelled together.
+    """
+    def __init__(self):
+        self.heap = [] # (deadline, seq, timer)
+        self.keys = {} # key -> set of timers
+        self.seq = count()
+        self.wake = asyncio.Event()
+        self.task = None
+
+        self.fired = 0
+
+    def now(self):
+        return asyncio.get_running_loop().time()
+
+    def schedule(self, delay: float, callback, *args, key=None):
+        """Call the coroutine function callback(*args) after delay seconds."""
+        timer = Timer(self.now() + delay, callback, args, key)
+        heapq.heappush(self.heap, (timer.deadline, next(self.seq), timer))
+
+        if key is not None:
+            self.keys.setdefault(key, set()).add(timer)
+
+        # New earliest deadline, the runner has to wake up sooner
+        if self.heap[0][2] is timer:
+            self.wake.set()
+
+        return timer
+
+    def cancel(self, timer: Timer):
+        timer.cancelled = True
+        if timer.key is not None and timer.key in self.keys:
+            self.keys[timer.key].discard(timer)
+            if not self.keys[timer.key]:
+                del self.keys[timer.key]
+
+    def cancelKey(self, key):
+        # Cancelled timers are dropped lazily when they reach the top of the heap
+        for timer in self.keys.pop(key, ()):
+            timer.cancelled = True
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            now = self.now()
+            while self.heap and (self.heap[0][2].cancelled or self.heap[0][0] <= now):
+                _, _, timer = heapq.heappop(self.heap)
+                if timer.cancelled: continue
+
+                self.cancel(timer)
+                self.fired += 1
+                asyncio.create_task(self.fire(timer))
+
+            timeout = self.heap[0][0] - now if self.heap else None
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def fire(self, timer: Timer):
+        try:
+            await timer.callback(*timer.args)
+        except Exception as e:
+            logger.warning("Timer callback %s failed: %s", getattr(timer.callback, "__name__", timer.callback), e)
+
+    def stats(self):
+        return {"pending": len(self.heap), "keys": len(self.keys), "fired": self.fired}
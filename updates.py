@@ -0,0 +1,55 @@
+import os
+import asyncio
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+class ChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to max_concurrent_updates updates at once, but one at a time per chat,
+    so conversation states still see a user's updates in order.
+    """
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.locks = {} # chat -> [asyncio.Lock, users]
+
+    async def process_update(self, update: object, coroutine):
+        chat = update.effective_chat.id if isinstance(update, Update) and update.effective_chat else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+
+        # Wait for the chat's turn before taking a concurrency slot, so a busy chat doesn't hold
+        # slots other chats could use
+        entry = self.locks.setdefault(chat, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[chat]
+
+    async def do_process_update(self, update: object, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def runApplication(application: Application):
+    """Serve updates by webhook or long polling, depending on BOT_MODE."""
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        # Telegram pushes updates to a local HTTP server
+        application.run_webhook(
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", 8443)),
+            url_path=os.getenv("WEBHOOK_PATH", "telegram"),
+            webhook_url=os.getenv("WEBHOOK_URL"),
+            secret_token=os.getenv("WEBHOOK_SECRET"),
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,36 @@
+import asyncio
+from db import DB, AsyncDB
+
+class VoiceCache:
+    def __init__(self, db: DB):
+        self.db = db
+        self.aioDB = AsyncDB(db)
+        self.locks = {}
+
+        self.db.execute_query('''CREATE TABLE IF NOT EXISTS voice_files (
+                            song TEXT PRIMARY KEY,
+                            file_id TEXT NOT NULL)''')
+
+        # song -> Telegram file_id
+        rows = self.db.fetch_all("SELECT song, file_id FROM voice_files")
+        self.fileIDs = {row["song"]: row["file_id"] for row in rows}
+
+    def get(self, song):
+        return self.fileIDs.get(song)
+
+    async def set(self, song, fileID):
+        self.fileIDs[song] = fileID
+        await self.aioDB.execute_query(
+            "INSERT OR REPLACE INTO voice_files (song, file_id) VALUES (?, ?)",
+            (song, fileID)
+        )
+
+    async def invalidate(self, song):
+        if self.fileIDs.pop(song, None) is not None:
+            await self.aioDB.delete("voice_files", "song = ?", (song,))
+
+    def lock(self, song):
+        """Per-song lock, so concurrent sends of a new song upload it only once."""
+        if song not in self.locks:
+            self.locks[song] = asyncio.Lock()
+        return self.locks[song]
@@ -1,11 +1,60 @@
 import os
+import time
+import uuid
+import sqlite3
+from aio import run
 from db import DB
+from keypool import KeyPool
+from rpc import BatchRPC
+from gas import GasOracle, TRANSFER_GAS
+from payouts import NonceManager, PayoutQueue
+from ledger import Ledger, toWei, fromWei
 from web3 import Web3, Account
+from web3.exceptions import TransactionNotFound
+
+def toHash(tx_hash):
+    # Hashes are stored the way HexBytes.hex() prints them, without 0x
+    return tx_hash if tx_hash.startswith("0x") else "0x" + tx_hash
+
+class BalanceCache:
+    def __init__(self, ttl: float = 5):
+        self.ttl = ttl
+        self.entries = {} # address -> (balance, ts)
+
+    def get(self, address):
+        entry = self.entries.get(address)
+        if not entry or time.time() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def set(self, address, balance):
+        self.entries[address] = (balance, time.time())
+
+    def invalidate(self, address=None):
+        if address is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(address, None)
 
 class Wallet:
     def __init__(self):
         self.db = DB("db/wallets.db")
         self.web3 = Web3(Web3.HTTPProvider(os.getenv("BSC_RPC_URL")))
+        self.balances = BalanceCache(float(os.getenv("BALANCE_CACHE_TTL", 5)))
+        self.nonces = NonceManager(self.web3)
+        self.rpc = BatchRPC(
+            os.getenv("BSC_RPC_URL"),
+            batchSize=int(os.getenv("RPC_BATCH_SIZE", 100)),
+            concurrency=int(os.getenv("RPC_BATCH_CONCURRENCY", 4))
+        )
+        self.gas = GasOracle(
+            self.web3,
+            maxPrice=self.web3.to_wei(os.getenv("GAS_PRICE_MAX_GWEI", "20"), 'gwei')
+        )
+
+        # Withdrawals are paid from the main wallet, user addresses only receive deposits
+        self.mainAddress = os.getenv("MAIN_WALLET")
+        self.mainKey = os.getenv("MAIN_WALLET_KEY")
 
         if not self.web3.is_connected():
             raise ConnectionError("Unable to connect to the BSC node.")
@@ -21,6 +70,30 @@ class Wallet:
                             address TEXT NOT NULL,
                             amount DOUBLE NOT NULL)''')
 
+        # Receipt tracking columns, added to databases created before them
+        for column in ["status TEXT DEFAULT 'pending'", "ref TEXT", "block INTEGER", "nonce INTEGER", "raw TEXT", "sent REAL"]:
+            try:
+                self.db.execute_query(f"ALTER TABLE transactions ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+
+        # Withdrawals sent before the ledger have no ref and nothing to confirm or refund
+        self.db.execute_query("UPDATE transactions SET status = 'settled' WHERE ref IS NULL AND status = 'pending'")
+
+        # Deposits moved from users' addresses to the main wallet
+        self.db.execute_query('''CREATE TABLE IF NOT EXISTS sweeps (
+                            tx_hash TEXT PRIMARY KEY,
+                            uid TEXT NOT NULL,
+                            address TEXT NOT NULL,
+                            amount INTEGER NOT NULL,
+                            ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+        self.db.execute_query("CREATE INDEX IF NOT EXISTS transactions_uid ON transactions (uid)")
+        self.db.execute_query("CREATE INDEX IF NOT EXISTS transactions_status ON transactions (status)")
+
+        self.ledger = Ledger(self.db)
+        self.keys = KeyPool(self.db, size=int(os.getenv("WALLET_POOL_SIZE", 100)))
+
     def createWallet(self, uid):
         if self.db.fetch_one("SELECT * FROM wallets WHERE uid = ?", (uid,)):
             raise ValueError("Wallet already exists for this user.")
@@ -38,45 +111,210 @@ class Wallet:
     def getWallet(self, uid):
         wallet = self.db.fetch_one("SELECT address, private_key FROM wallets WHERE uid = ?", (uid,))
         if not wallet:
-            return self.createWallet(uid)
+            try:
+                # Claim a pre-generated key, only create one here if the pool ran dry
+                return self.keys.claim(uid) or self.createWallet(uid)
+            except sqlite3.IntegrityError:
+                # Created by a concurrent call
+                wallet = self.db.fetch_one("SELECT address, private_key FROM wallets WHERE uid = ?", (uid,))
         return {"address": wallet[0], "private_key": wallet[1]}
 
+    def chainBalance(self, address, cached=True):
+        """On-chain balance of an address in wei, cached until the next block."""
+        balance = self.balances.get(address) if cached else None
+        if balance is None:
+            balance = self.web3.eth.get_balance(address)
+            self.balances.set(address, balance)
+        return balance
+
     def getBalance(self, uid):
-        wallet = self.getWallet(uid)
-        address = wallet["address"]
+        # Deposits are credited to the ledger by the deposit watcher
+        return self.ledger.balance(uid)
+
+    def getBalances(self, uids: list):
+        """Spendable balances of many users in BNB, read from the ledger in bulk."""
+        return self.ledger.balances(uids)
+
+    def getChainBalances(self, uids: list):
+        """
+        On-chain balances of many users' deposit addresses in BNB, fetched with batched RPC calls.
+        Not what the users can spend: deposits are credited to the ledger, and games and
+        withdrawals never touch these addresses. Users without a wallet are left out.
+        """
+        addresses = {}
+        uids = [str(uid) for uid in uids]
+        for i in range(0, len(uids), 500):
+            chunk = uids[i:i + 500]
+            rows = self.db.fetch_all(
+                f"SELECT uid, address FROM wallets WHERE uid IN ({', '.join(['?'] * len(chunk))})",
+                chunk
+            )
+            addresses.update({row["address"]: row["uid"] for row in rows})
+
+        balances = self.rpc.getBalances(list(addresses.keys()))
+        return {addresses[address]: fromWei(wei) for address, wei in balances.items()}
+
+    def pendingAddresses(self, addresses: list):
+        """Addresses with sent transactions not mined yet, their pending nonce is ahead of the latest."""
+        pending = self.rpc.getTransactionCounts(addresses, "pending")
+        latest = self.rpc.getTransactionCounts(addresses, "latest")
+        return {address for address in addresses if pending[address] > latest[address]}
+
+    def escrow(self, gameID, players, amount):
+        return self.ledger.escrow(gameID, players, amount)
+
+    def settle(self, gameID, winner, fee):
+        return self.ledger.settle(gameID, winner, fee)
+
+    def refund(self, gameID):
+        return self.ledger.refund(gameID)
 
-        # Get the balance in wei and convert to Ether
-        balance = self.web3.eth.get_balance(address)
-        return self.web3.from_wei(balance, 'ether')
+    def refundAbandoned(self, before: float):
+        """Refund the bets of games left running when the bot stopped, returns their IDs."""
+        return [gameID for gameID in self.ledger.abandonedEscrows(before) if self.ledger.refund(gameID)]
 
     def withdraw(self, uid, recipientAddress, amount):
-        wallet = self.getWallet(uid)
-        private_key = wallet["private_key"]
-        address = wallet["address"]
+        if self.chainBalance(self.mainAddress) < toWei(amount):
+            raise ValueError("Main wallet cannot cover this withdrawal right now.")
 
-        # Get the current balance
-        balance = self.getBalance(uid)
+        # Take the amount off the ledger first, raises InsufficientFunds
+        ref = str(uuid.uuid4())
+        self.ledger.withdraw(uid, amount, ref)
 
-        if float(amount) > float(balance):
-            raise ValueError("Insufficient funds.")
+        address = self.mainAddress
+        try:
+            nonce = self.nonces.allocate(address)
+            tx_hash, raw = self.sign(recipientAddress, amount, nonce)
+        except Exception:
+            # Nothing was sent, resync the nonce from the node
+            self.nonces.reset(address)
+            self.ledger.reverseWithdraw(uid, amount, ref)
+            raise
 
-        # Construct the transaction
-        nonce = self.web3.eth.get_transaction_count(address)
+        # Recorded before broadcasting, the receipt tracker confirms, rebroadcasts or fails it
+        self.db.insert("transactions", {
+            "tx_hash": tx_hash,
+            "uid": uid,
+            "address": recipientAddress,
+            "amount": amount,
+            "status": "pending",
+            "ref": ref,
+            "nonce": nonce,
+            "raw": raw,
+            "sent": time.time(),
+        })
+
+        try:
+            self.broadcast(raw)
+        except Exception:
+            # A timeout can come after the node accepted it, only a transaction it doesn't know is refunded
+            if self.getTransaction(tx_hash) is None:
+                self.nonces.reset(address)
+                self.settleTransaction(tx_hash, uid, amount, ref, False, None)
+                raise
+
+        self.balances.invalidate(address)
+        return { "tx_hash": tx_hash }
+
+    def sign(self, recipientAddress, amount, nonce):
+        """
+        Sign a transfer from the main wallet.
+        :return: Transaction hash, known before it is sent, and the raw transaction
+        """
         transaction = {
             'nonce': nonce,
             'to': recipientAddress,
             'value': self.web3.to_wei(amount, 'ether'),
-            'gasPrice': self.web3.to_wei('20', 'gwei')
+            'gasPrice': self.gas.gasPrice()
         }
 
-        transaction["gas"] = self.web3.eth.estimate_gas(transaction)
+        transaction["gas"] = self.gas.gasLimit(transaction)
+
+        signed_txn = self.web3.eth.account.sign_transaction(transaction, self.mainKey)
+        return signed_txn.hash.hex(), Web3.to_hex(signed_txn.raw_transaction)
+
+    def broadcast(self, raw):
+        self.web3.eth.send_raw_transaction(raw)
+
+    def rebroadcast(self, tx_hash, raw):
+        """Send a pending transaction again, in case the mempool dropped it."""
+        self.db.update("transactions", {"sent": time.time()}, "tx_hash = ?", (tx_hash,))
+        self.broadcast(raw)
+
+    def sweep(self, uid, address, privateKey, wei, gasPrice):
+        """Send wei from a user's deposit address to the main wallet, the caller leaves the gas on it."""
+        transaction = {
+            'nonce': self.web3.eth.get_transaction_count(address, "pending"),
+            'to': self.mainAddress,
+            'value': wei,
+            'gas': TRANSFER_GAS,
+            'gasPrice': gasPrice
+        }
+
+        signed_txn = self.web3.eth.account.sign_transaction(transaction, privateKey)
+        tx_hash = self.web3.eth.send_raw_transaction(signed_txn.raw_transaction).hex()
+
+        self.db.insert("sweeps", {"tx_hash": tx_hash, "uid": uid, "address": address, "amount": wei})
+        self.balances.invalidate(address)
+        self.balances.invalidate(self.mainAddress)
+        return tx_hash
+
+    def getReceipt(self, tx_hash):
+        try:
+            return self.web3.eth.get_transaction_receipt(toHash(tx_hash))
+        except TransactionNotFound:
+            return None
+
+    def getTransaction(self, tx_hash):
+        """The transaction as the node knows it, mined or in its mempool."""
+        try:
+            return self.web3.eth.get_transaction(toHash(tx_hash))
+        except TransactionNotFound:
+            return None
+
+    def settleTransaction(self, tx_hash, uid, amount, ref, confirmed, block):
+        self.db.update(
+            "transactions",
+            {"status": "confirmed" if confirmed else "failed", "block": block},
+            "tx_hash = ?",
+            (tx_hash,)
+        )
+
+        # Reverted on-chain, the user gets the funds back
+        if not confirmed and ref:
+            self.ledger.reverseWithdraw(uid, amount, ref)
+
+class AsyncWallet:
+    """
+    Awaitable facade over Wallet, ledger and RPC calls run in the shared I/O thread pool.
+    """
+    def __init__(self, wallet: Wallet):
+        self.wallet = wallet
+        self.payouts = PayoutQueue(wallet)
+
+    async def getWallet(self, uid):
+        return await run(self.wallet.getWallet, uid)
+
+    async def getBalance(self, uid):
+        return await run(self.wallet.getBalance, uid)
+
+    async def getBalances(self, uids: list):
+        return await run(self.wallet.getBalances, uids)
+
+    async def getChainBalances(self, uids: list):
+        return await run(self.wallet.getChainBalances, uids)
+
+    async def escrow(self, gameID, players, amount):
+        return await run(self.wallet.escrow, gameID, players, amount)
+
+    async def settle(self, gameID, winner, fee):
+        return await run(self.wallet.settle, gameID, winner, fee)
 
-        # Sign the transaction
-        signed_txn = self.web3.eth.account.sign_transaction(transaction, private_key)
-        print(signed_txn)
+    async def refund(self, gameID):
+        return await run(self.wallet.refund, gameID)
 
-        # Send the transaction
-        tx_hash = self.web3.eth.send_raw_transaction(signed_txn.raw_transaction)
-        self.db.insert("transactions", {"tx_hash": tx_hash.hex(), "uid": uid, "address": address, "amount": amount})
+    async def refundAbandoned(self, before: float):
+        return await run(self.wallet.refundAbandoned, before)
 
-        return { "tx_hash": tx_hash.hex() }
\ No newline at end of file
+    async def withdraw(self, uid, recipientAddress, amount):
+        return await self.payouts.submit(uid, recipientAddress, amount)
\ No newline at end of file